@@ -0,0 +1,45 @@
+#!/bin/python3
+#
+# autosave.py
+#
+# Background thread that saves a dungeon while the input loop keeps running
+
+import sys
+import threading
+
+class Autosave(threading.Thread):
+    """Calls state.save() at most every interval seconds, whenever notify() was called since the last save.
+    The state's lock is only taken to collect the changes, the files are written without it."""
+    def __init__(self, state, interval=5):
+        super().__init__(daemon=True)
+        self.state = state
+        self.interval = interval
+        self._dirty = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self):
+        """Tells the thread there is something to save."""
+        self._dirty.set()
+
+    def stop(self):
+        """Ends the thread after a last save."""
+        self._stopped.set()
+        self._dirty.set()
+        self.join()
+
+    def run(self):
+        while not(self._stopped.is_set()):
+            self._dirty.wait()
+            self._dirty.clear()
+            self._save()
+            # changes in the meantime wait for the next round
+            self._stopped.wait(self.interval)
+        self._save()
+
+    def _save(self):
+        # a failed save, e.g. on a full disk, is tried again next round instead of ending the thread
+        try:
+            self.state.save()
+        except Exception as e:
+            print("Error: Could not save the dungeon, trying again later: " + repr(e), file=sys.stderr)
+            self._dirty.set()
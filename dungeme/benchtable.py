@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+#
+# benchtable.py
+#
+# Timing and statistical conformance checks for table.py. Prints results as JSON, so runs before and after a change can be compared.
+
+import sys
+import json
+import time
+from math import exp, log, lgamma, isqrt
+from table import *
+from rng import Stream
+
+HELPTEXT = """benchtable.py - Benchmark and verify random tables
+Usage: benchtable.py [OPTIONS]
+
+Options
+  --rolls N - Number of rolls per table for the chi-square test, default 1000000
+  --seed SEED - Seed for all rolls, default 1
+  --out FILE - Write the JSON results to FILE instead of stdout
+  --compare FILE - Compare the timings with an earlier JSON result and print the ratios
+  --help - Print this help text
+"""
+
+TABLETYPES = ["1d4", "1d6", "1d20", "1d100", "1d1000", "1d10000", "2d6", "3d6", "10d10"]
+
+def mkTable(w, rng):
+    """A table of type w with entries of random width, filling most but not all of its range. Bigger tables get more and wider entries."""
+    e = parseDice(w)
+    t = Table(e.terms[0].dice, e.terms[0].sides, w)
+    (lower, upper) = t.tableRange()
+    n = lower
+    i = 0
+    while n <= upper:
+        width = rng.randint(1, max(1, isqrt(upper - lower + 1)))
+        if rng.random() < 0.9:
+            t.setEntryRange(n, min(upper, n + width - 1), "entry " + str(i))
+        n += width
+        i += 1
+    return t
+
+def timeOp(f, minTime=0.05):
+    """Seconds per call of f, best of three runs that each take at least minTime."""
+    n = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(n):
+            f()
+        elapsed = time.perf_counter() - start
+        if elapsed >= minTime:
+            break
+        n *= 2
+    best = elapsed / n
+    for k in range(2):
+        start = time.perf_counter()
+        for i in range(n):
+            f()
+        best = min(best, (time.perf_counter() - start) / n)
+    return best
+
+def timeTable(t, rng):
+    (lower, upper) = t.tableRange()
+    mid = (lower + upper) // 2
+    acc = {}
+    acc["pick"] = timeOp(lambda: t.pick(rng.randint(lower, upper)))
+    acc["roll"] = timeOp(lambda: t.roll(rng))
+    # setting an entry changes the table, so work on a copy
+    c = Table.fromDict(t.toDict())
+    acc["_setEntry"] = timeOp(lambda: c._setEntry((mid, min(upper, mid + 2)), "x"))
+    acc["freeEntries"] = timeOp(t.freeEntries)
+    acc["entryRangeProbability"] = timeOp(lambda: t.entryRangeProbability(lower, mid))
+    acc["showTable"] = timeOp(lambda: t.showTable(True, True))
+    return acc
+
+def growth(sizes, timings):
+    """Least squares slope of log(time) against log(size), i.e. the exponent k in time ~ size^k."""
+    xs = [log(s) for s in sizes]
+    ys = [log(max(t, 1e-12)) for t in timings]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    sxx = sum([(x - mx) ** 2 for x in xs])
+    if sxx == 0:
+        return 0.0
+    return sum([(x - mx) * (y - my) for (x, y) in zip(xs, ys)]) / sxx
+
+def gammaQ(a, x):
+    """Regularized upper incomplete gamma function Q(a, x)."""
+    if x <= 0:
+        return 1.0
+    if x < a + 1:
+        # series for P(a, x)
+        term = 1.0 / a
+        total = term
+        n = a
+        for i in range(1000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return 1.0 - total * exp(-x + a * log(x) - lgamma(a))
+    # continued fraction for Q(a, x)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        if abs(d) < tiny:
+            d = tiny
+        c = b + an / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return exp(-x + a * log(x) - lgamma(a)) * h
+
+def chiSquare(t, n, rng):
+    """Rolls n times on t and compares the counts with the exact probabilities of the table. Bins with fewer than 5 expected results are pooled."""
+    observed = t.histogram(n, rng)
+    bins = []
+    (pooledExpected, pooledObserved) = (0.0, 0)
+    for (w, p) in sorted(t.outcomes(), key=lambda x: x[1]):
+        expected = float(p) * n
+        if expected + pooledExpected < 5:
+            pooledExpected += expected
+            pooledObserved += observed.get(w, 0)
+            continue
+        bins.append((expected + pooledExpected, observed.get(w, 0) + pooledObserved))
+        (pooledExpected, pooledObserved) = (0.0, 0)
+    if bins and pooledExpected:
+        (e, o) = bins[-1]
+        bins[-1] = (e + pooledExpected, o + pooledObserved)
+
+    statistic = sum([(o - e) ** 2 / e for (e, o) in bins])
+    df = len(bins) - 1
+    if df < 1:
+        return {"statistic": statistic, "df": df, "p": 1.0}
+    return {"statistic": statistic, "df": df, "p": gammaQ(df / 2, statistic / 2)}
+
+def run(rolls, seed):
+    rng = Stream(seed)
+    results = {"rolls": rolls, "seed": seed, "tables": {}}
+    for w in TABLETYPES:
+        t = mkTable(w, rng.split(("table", w)))
+        (lower, upper) = t.tableRange()
+        timings = timeTable(t, rng.split(("time", w)))
+        start = time.perf_counter()
+        chi = chiSquare(t, rolls, rng.split(("chi", w)))
+        chi["seconds"] = time.perf_counter() - start
+        results["tables"][w] = {"size": upper - lower + 1, "entries": len(t._starts), "timings": timings, "chisquare": chi}
+
+    # how each operation grows with the number of rollable results, for the single die tables
+    single = [w for w in TABLETYPES if w.startswith("1d")]
+    sizes = [results["tables"][w]["size"] for w in single]
+    results["growth"] = {op: growth(sizes, [results["tables"][w]["timings"][op] for w in single]) for op in results["tables"][single[0]]["timings"]}
+    return results
+
+def compare(old, new):
+    w = "table\toperation\tbefore\tafter\tratio\n"
+    for (name, t) in new["tables"].items():
+        if not(name in old["tables"]):
+            continue
+        for (op, after) in t["timings"].items():
+            before = old["tables"][name]["timings"].get(op)
+            if before:
+                w += name + "\t" + op + "\t" + "%.3g" % before + "\t" + "%.3g" % after + "\t" + "%.2f" % (after / before) + "\n"
+    return w
+
+def main(argv):
+    if "--help" in argv:
+        print(HELPTEXT)
+        return
+
+    opts = {"--rolls": "1000000", "--seed": "1", "--out": "", "--compare": ""}
+    for (i, w) in enumerate(argv):
+        if (w in opts) and (i + 1 < len(argv)):
+            opts[w] = argv[i + 1]
+
+    results = run(int(opts["--rolls"]), int(opts["--seed"]))
+    out = json.dumps(results, indent=2)
+    if opts["--out"]:
+        f = open(opts["--out"], "w")
+        f.write(out)
+        f.close()
+    else:
+        print(out)
+
+    if opts["--compare"]:
+        print(compare(json.load(open(opts["--compare"])), results), file=sys.stderr)
+
+    # a p-value this small means the rolls don't follow the computed probabilities
+    failed = [w for (w, t) in results["tables"].items() if t["chisquare"]["p"] < 1e-4]
+    if failed:
+        print("Chi-square test failed for: " + ", ".join(failed), file=sys.stderr)
+        exit(1)
+
+if (__name__ == "__main__"):
+    main(sys.argv)
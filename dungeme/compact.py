@@ -0,0 +1,204 @@
+#!/bin/python3
+#
+# compact.py
+#
+# Compact in-memory form of a dungeon for very big, e.g. generated, dungeons. Rooms are __slots__ records in a list indexed by
+# their integer id, and the paths between them are flat arrays in compressed sparse row form with directions as small ints.
+# Converts to and from the data of a dungeon file (the first element of its JSON list) without losing anything.
+
+from array import array
+from collections import deque
+import gc
+
+DIRECTIONS = "n ne e se s sw w nw up down".split()
+
+# top level keys of a dungeon file in the order of State.blueprint
+DATAKEYS = ["skills", "table_map", "current_room", "next_id", "rooms", "edges"]
+
+# a target without any path, which the JSON form can hold as an empty list
+NOPATH = -1
+
+class Room(object):
+    """A room of a compact dungeon. notes and skillChecks are None for rooms that never had them, extra holds any other keys of the room dict."""
+    __slots__ = ("id", "name", "description", "notes", "skillChecks", "extra", "keys")
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.description = None
+        self.notes = None
+        self.skillChecks = None
+        self.extra = None
+        # order of the keys in the room dict, only kept if it isn't the order create makes
+        self.keys = None
+
+    def fromDict(d):
+        r = Room(int(d["id"]), d.get("name"))
+        r.description = d.get("description")
+        # empty lists are shared as (), every room made by create has one
+        r.notes = d.get("notes")
+        if r.notes == []:
+            r.notes = ()
+        r.skillChecks = d.get("skill_checks")
+        if r.skillChecks == []:
+            r.skillChecks = ()
+        keys = list(d)
+        if keys == CREATEKEYS:
+            return r
+        extra = {k : v for (k, v) in d.items() if not(k in ROOMKEYS)}
+        if extra:
+            r.extra = extra
+        # the keys toDict would give without a stored order
+        if keys != ["id", "name"] + [k for k in ["skill_checks", "notes", "description"] if d.get(k) is not None] + list(extra):
+            r.keys = tuple(keys)
+        return r
+
+    def toDict(self):
+        values = {"id" : str(self.id), "name" : self.name, "skill_checks" : self.skillChecks, "notes" : self.notes, "description" : self.description}
+        for k in ["skill_checks", "notes"]:
+            if values[k] == ():
+                values[k] = []
+        if self.extra:
+            values.update(self.extra)
+        if self.keys:
+            return {k : values[k] for k in self.keys}
+        d = {"id" : values["id"], "name" : self.name}
+        for k in ["skill_checks", "notes", "description"]:
+            if values[k] is not None:
+                d[k] = values[k]
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+# keys of a room dict with their own slot
+ROOMKEYS = ["id", "name", "description", "notes", "skill_checks"]
+
+# keys of a room made by State.create
+CREATEKEYS = ["id", "name", "skill_checks"]
+
+class CompactDungeon(object):
+    """A dungeon with integer room ids. rooms[i] is the Room with id i or None. The paths going out from room i are the
+    pairs (targets[j], codes[j]) for offsets[i] <= j < offsets[i + 1], where a code indexes into pathNames (the directions first)."""
+    def __init__(self):
+        self.rooms = []
+        self.meta = {}
+        self.current = 0
+        self.nextId = 1
+        self.pathNames = list(DIRECTIONS)
+        self.offsets = array("q", [0])
+        self.targets = array("q")
+        self.codes = array("h")
+        # 1 for the rooms that have an entry in edges, even an empty one
+        self.hasEdges = bytearray()
+        # room id to list of table ids
+        self.tableMap = {}
+        # order of the rooms in edges and of the top level keys, None if it is the usual one
+        self.sourceOrder = None
+        self.dataKeys = None
+
+    def fromData(data):
+        """Builds a compact dungeon from the data of a dungeon file. Room ids have to be numbers, as create makes them."""
+        # millions of new objects without cycles, see loadData in dungeme.py
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return CompactDungeon._fromData(data)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _fromData(data):
+        c = CompactDungeon()
+        n = 1 + max([int(k) for k in list(data.get("rooms", {})) + list(data.get("edges", {}))] + [-1])
+        c.rooms = [None] * n
+        for (k, d) in data.get("rooms", {}).items():
+            c.rooms[int(k)] = Room.fromDict(d)
+        c.hasEdges = bytearray(n)
+
+        codes = {w : i for (i, w) in enumerate(c.pathNames)}
+        edges = data.get("edges", {})
+        # sources in the order of the dungeon file, so the edges come out the same way
+        sources = [int(k) for k in edges]
+        if sources != sorted(sources):
+            c.sourceOrder = array("q", sources)
+        perRoom = [None] * n
+        for (k, targets) in edges.items():
+            perRoom[int(k)] = targets
+        for i in range(n):
+            targets = perRoom[i]
+            if targets is not None:
+                c.hasEdges[i] = 1
+                for (target, paths) in targets.items():
+                    if not(paths):
+                        c.targets.append(int(target))
+                        c.codes.append(NOPATH)
+                    for path in paths:
+                        if not(path in codes):
+                            codes[path] = len(c.pathNames)
+                            c.pathNames.append(path)
+                        c.targets.append(int(target))
+                        c.codes.append(codes[path])
+            c.offsets.append(len(c.targets))
+
+        c.tableMap = {int(k) : v for (k, v) in data.get("table_map", {}).items()}
+        c.current = int(data.get("current_room", "0"))
+        c.nextId = data.get("next_id", 1)
+        c.meta = {k : v for (k, v) in data.items() if not(k in ["rooms", "edges", "table_map", "current_room", "next_id"])}
+        if list(data) != DATAKEYS:
+            c.dataKeys = list(data)
+        return c
+
+    def toData(self):
+        """The data of a dungeon file for this dungeon, with string ids as in JSON."""
+        rooms = {str(r.id) : r.toDict() for r in self.rooms if r is not None}
+        edges = {}
+        order = self.sourceOrder
+        if order is None:
+            order = [i for i in range(len(self.hasEdges)) if self.hasEdges[i]]
+        for i in order:
+            targets = {}
+            for j in range(self.offsets[i], self.offsets[i + 1]):
+                ps = targets.setdefault(str(self.targets[j]), [])
+                if self.codes[j] != NOPATH:
+                    ps.append(self.pathNames[self.codes[j]])
+            edges[str(i)] = targets
+        values = dict(self.meta)
+        values.update({"table_map" : {str(k) : v for (k, v) in self.tableMap.items()}, "current_room" : str(self.current), "next_id" : self.nextId, "rooms" : rooms, "edges" : edges})
+        d = {k : values[k] for k in (self.dataKeys or DATAKEYS) if k in values}
+        d.update({k : v for (k, v) in values.items() if not(k in d)})
+        return d
+
+    def exits(self, i):
+        """(path name, target) pairs of the paths going out from room i."""
+        if i + 1 >= len(self.offsets):
+            return []
+        return [(self.pathNames[self.codes[j]], self.targets[j]) for j in range(self.offsets[i], self.offsets[i + 1]) if self.codes[j] != NOPATH]
+
+    def follow(self, i, direction):
+        """The room reached from room i going direction, the first one like State.follow. None if there is no such path."""
+        code = self.pathNames.index(direction) if direction in self.pathNames else None
+        if (code is None) or (i + 1 >= len(self.offsets)):
+            return None
+        for j in range(self.offsets[i], self.offsets[i + 1]):
+            if self.codes[j] == code:
+                return self.targets[j]
+        return None
+
+    def distances(self, start):
+        """Number of steps from room start to every room, an array indexed by room id with -1 for rooms that can't be reached."""
+        n = len(self.offsets) - 1
+        dist = array("q", [-1]) * max(n, len(self.rooms))
+        dist[start] = 0
+        queue = deque([start])
+        (offsets, targets, codes) = (self.offsets, self.targets, self.codes)
+        while queue:
+            u = queue.popleft()
+            if u >= n:
+                continue
+            d = dist[u] + 1
+            for j in range(offsets[u], offsets[u + 1]):
+                v = targets[j]
+                if (codes[j] != NOPATH) and (v < len(dist)) and (dist[v] < 0):
+                    dist[v] = d
+                    queue.append(v)
+        return dist
@@ -0,0 +1,258 @@
+#!/bin/python3
+#
+# dice.py
+#
+# Library for dice expressions like 3d6+1d4-2, 4d6kh3 or 2d20kl1, with sampling and exact distributions
+
+import random
+from math import comb
+
+_sumDistributions = {}
+_keepDistributions = {}
+_expressions = {}
+
+class Distribution(object):
+    """Exact distribution of the results of a roll. Counts are kept as integers, so probabilities are exact up to the final division."""
+    def __init__(self, lower, counts):
+        self.lower = lower
+        self.upper = lower + len(counts) - 1
+        self.counts = counts
+        # cumulative[i] is the number of ways to roll less than lower + i
+        acc = 0
+        cumulative = [0]
+        for c in counts:
+            acc += c
+            cumulative.append(acc)
+        self.cumulative = cumulative
+        self.total = acc
+
+    def range(self):
+        return (self.lower, self.upper)
+
+    def rangeCount(self, start, end):
+        """Number of ways to roll a result between start and end, inclusive."""
+        start = max(start, self.lower)
+        end = min(end, self.upper)
+        if start > end:
+            return 0
+        return self.cumulative[end - self.lower + 1] - self.cumulative[start - self.lower]
+
+    def rangeProbability(self, start, end):
+        return self.rangeCount(start, end) / self.total
+
+    def probability(self, n):
+        return self.rangeProbability(n, n)
+
+    def cdf(self, n):
+        """Probability of rolling n or less."""
+        return self.rangeProbability(self.lower, n)
+
+
+def sumDistribution(dice, sides):
+    """Returns the distribution of the sum of rolling a number of dice with the given sides, e.g. sumDistribution(2, 6) for 2d6. Results are cached."""
+    key = (dice, sides)
+    if key in _sumDistributions:
+        return _sumDistributions[key]
+
+    # start from the largest number of dice we already know
+    n = dice
+    while (n > 0) and not((n, sides) in _sumDistributions):
+        n -= 1
+    dist = _sumDistributions.get((n, sides), Distribution(0, [1]))
+
+    # add one die at a time, every new count is a window sum over the old counts
+    while n < dice:
+        p = dist.cumulative
+        m = len(dist.counts)
+        counts = [p[min(k, m - 1) + 1] - p[max(0, k - sides + 1)] for k in range(m + sides - 1)]
+        dist = Distribution(dist.lower + 1, counts)
+        n += 1
+        _sumDistributions[(n, sides)] = dist
+
+    _sumDistributions[key] = dist
+    return dist
+
+
+def keepDistribution(dice, sides, keep, highest=True):
+    """Returns the distribution of keeping the keep highest (or lowest) of a number of dice, e.g. keepDistribution(4, 6, 3) for 4d6kh3. Results are cached."""
+    key = (dice, sides, keep, highest)
+    if key in _keepDistributions:
+        return _keepDistributions[key]
+
+    keep = min(keep, dice)
+    # go through the faces starting with the ones we keep first, counting how many dice show each face.
+    # ways[j] maps the sum of kept dice to the number of ways j dice can show the faces seen so far
+    ways = [dict() for j in range(dice + 1)]
+    ways[0][0] = 1
+    if highest:
+        faces = range(sides, 0, -1)
+    else:
+        faces = range(1, sides + 1)
+    for f in faces:
+        new = [dict() for j in range(dice + 1)]
+        for j in range(dice + 1):
+            for (s, n) in ways[j].items():
+                for c in range(dice - j + 1):
+                    kept = s + f * min(c, max(0, keep - j))
+                    m = new[j + c]
+                    m[kept] = m.get(kept, 0) + n * comb(dice - j, c)
+        ways = new
+
+    result = ways[dice]
+    lower = min(result)
+    counts = [result.get(s, 0) for s in range(lower, max(result) + 1)]
+    dist = Distribution(lower, counts)
+    _keepDistributions[key] = dist
+    return dist
+
+
+def combine(d1, d2):
+    """Returns the distribution of the sum of two independent rolls."""
+    if len(d1.counts) == 1:
+        return Distribution(d1.lower + d2.lower, [d1.counts[0] * c for c in d2.counts])
+    if len(d2.counts) == 1:
+        return combine(d2, d1)
+    counts = [0] * (len(d1.counts) + len(d2.counts) - 1)
+    for (i, a) in enumerate(d1.counts):
+        if a:
+            for (j, b) in enumerate(d2.counts):
+                counts[i + j] += a * b
+    return Distribution(d1.lower + d2.lower, counts)
+
+
+def negate(d):
+    return Distribution(-d.upper, list(reversed(d.counts)))
+
+
+class DiceTerm(object):
+    """A single term of a dice expression, like 3d6, 4d6kh3 or a constant (sides 0)."""
+    def __init__(self, sign, dice, sides, keep=None, highest=True):
+        self.sign = sign
+        self.dice = dice
+        self.sides = sides
+        self.keep = keep
+        self.highest = highest
+
+    def __str__(self):
+        if self.sides == 0:
+            return str(self.dice)
+        w = str(self.dice) + "d" + str(self.sides)
+        if self.keep is not None:
+            w += ("kh" if self.highest else "kl") + str(self.keep)
+        return w
+
+    def distribution(self):
+        if self.sides == 0:
+            d = Distribution(self.dice, [1])
+        elif self.keep is None:
+            d = sumDistribution(self.dice, self.sides)
+        else:
+            d = keepDistribution(self.dice, self.sides, self.keep, self.highest)
+        if self.sign < 0:
+            return negate(d)
+        return d
+
+    def roll(self, rng=None):
+        if self.sides == 0:
+            return self.sign * self.dice
+        r = (rng or random).randint
+        rs = [r(1, self.sides) for i in range(self.dice)]
+        if self.keep is not None:
+            rs = sorted(rs, reverse=self.highest)[:self.keep]
+        return self.sign * sum(rs)
+
+
+class DiceExpression(object):
+    """A parsed dice expression. Use parseDice to get one, expressions are cached per string."""
+    def __init__(self, terms):
+        self.terms = terms
+        self._distribution = None
+
+    def __str__(self):
+        w = ""
+        for t in self.terms:
+            if t.sign < 0:
+                w += "-"
+            elif w:
+                w += "+"
+            w += str(t)
+        return w
+
+    def distribution(self):
+        """Exact distribution of the expression, computed once."""
+        if self._distribution is None:
+            d = Distribution(0, [1])
+            for t in self.terms:
+                d = combine(d, t.distribution())
+            self._distribution = d
+        return self._distribution
+
+    def range(self):
+        return self.distribution().range()
+
+    def minimum(self):
+        return self.distribution().lower
+
+    def maximum(self):
+        return self.distribution().upper
+
+    def average(self):
+        d = self.distribution()
+        return sum([(d.lower + i) * c for (i, c) in enumerate(d.counts)]) / d.total
+
+    def roll(self, rng=None):
+        return sum([t.roll(rng) for t in self.terms])
+
+    def rollMany(self, n, rng=None):
+        """Returns a list of n results, drawn from the exact distribution."""
+        d = self.distribution()
+        rs = range(d.lower, d.upper + 1)
+        return (rng or random).choices(rs, cum_weights=d.cumulative[1:], k=n)
+
+
+def _parseTerm(w, sign):
+    w = w.lower()
+    if w.isnumeric():
+        return DiceTerm(sign, int(w), 0)
+
+    keep = None
+    highest = True
+    for (suffix, h) in [("kh", True), ("kl", False), ("k", True)]:
+        if suffix in w:
+            (w, k) = w.split(suffix, 1)
+            if not(k.isnumeric()):
+                raise ValueError("Not a valid number of dice to keep: " + k)
+            (keep, highest) = (int(k), h)
+            break
+
+    ws = w.split("d")
+    if len(ws) != 2:
+        raise ValueError("Not a valid dice term: " + w)
+    (n, s) = ws
+    if n == "":
+        n = "1"
+    if not(n.isnumeric()) or not(s.isnumeric()) or (int(n) < 1) or (int(s) < 1):
+        raise ValueError("Not a valid dice term: " + w)
+    return DiceTerm(sign, int(n), int(s), keep, highest)
+
+
+def parseDice(w):
+    """Parses a dice expression like 3d6+1d4-2, 4d6kh3 or 2d20kl1. Raises ValueError if it can't be parsed. Expressions are cached, so every string is only parsed once."""
+    if w in _expressions:
+        return _expressions[w]
+
+    ws = w.replace(" ", "").replace("-", "+-").split("+")
+    terms = []
+    for t in ws:
+        if t == "":
+            continue
+        if t[0] == "-":
+            terms.append(_parseTerm(t[1:], -1))
+        else:
+            terms.append(_parseTerm(t, 1))
+    if not(terms):
+        raise ValueError("Empty dice expression.")
+
+    e = DiceExpression(terms)
+    _expressions[w] = e
+    return e
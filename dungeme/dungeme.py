@@ -10,28 +10,30 @@ from random import randrange
 import json
 import sys
 import copy
+import threading
+import queue
+import marshal
+import gc
+import struct
+import zlib
 from table import *
+from tablegraph import TableGraph
+from rng import Stream
+from tableimport import readTables
+from autosave import Autosave
+from layout import Layout, renderMap
+from search import SearchIndex, words
+from sqlstore import isDatabase, openDungeon, writeDungeon
 
 DEFAULTSKILLDICT = { "str" : "Strength", "dex" : "Dexterity", "con" : "Constitution", "int" : "Intelligence", "wis" : "Wisdom", "cha" : "Charisma" }
 
 directions = "n ne e se s sw w nw up down".split()
 opdir = "s sw w nw n ne e se down up".split()
 
+opposites = dict(zip(directions, opdir))
+
 def opposite(direction):
-    d = {}
-    for i in range(len(directions)):
-        d[directions[i]] = opdir[i]
-
-    return d[direction]
-
-def yesnoInput(prompt):
-    while True:
-        w = input(prompt + " [y/n]:")
-        if w == "y":
-            return True
-        if w == "n":
-            return False
-        
+    return opposites[direction]
 
 def multilineInput(prompt):
     w = input(prompt)
@@ -41,24 +43,144 @@ def multilineInput(prompt):
         w = input("> ")
     return "\n".join(ws)
 
+# the journal is merged into the dungeon file once it is bigger than this, or than the dungeon file itself
+JOURNALMINSIZE = 1 << 20
+
+# number of commands that can be undone
+UNDOLIMIT = 1000
+
+# seconds between autosaves at most
+AUTOSAVEINTERVAL = 5
+
+# number of target rooms whose shortest paths are kept, see State._routeTree
+ROUTECACHESIZE = 16
+
+# squares shown around the current room by map
+MAPRADIUS = 3
+
+def journalFile(filename):
+    return filename + ".journal"
+
+def cacheFile(filename):
+    return filename + ".cache"
+
+# header of a cache file: magic, cache version, marshal version, and the modification time, change time and size of the dungeon file
+# it was made from. The change time can't be set back like the modification time, e.g. by cp -p or rsync. The dungeon file isn't
+# hashed, that would mean reading all of it, so an edit keeping the size within the resolution of the file system's timestamps isn't seen
+CACHEHEADER = struct.Struct("<4sIIqqq")
+CACHEVERSION = 2
+
+def _cacheStamp(st):
+    return (b"DGMC", CACHEVERSION, marshal.version, st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+
+def readCache(filename, st):
+    """The contents of a dungeon file from its binary cache, None if there is no cache or the dungeon file changed since it was made.
+    st is the os.stat of the dungeon file."""
+    try:
+        f = open(cacheFile(filename), "rb")
+    except OSError:
+        return None
+    header = f.read(CACHEHEADER.size)
+    if (len(header) != CACHEHEADER.size) or (CACHEHEADER.unpack(header) != _cacheStamp(st)):
+        f.close()
+        return None
+    try:
+        data = marshal.loads(zlib.decompress(f.read()))
+    except (ValueError, EOFError, TypeError, zlib.error):
+        data = None
+    f.close()
+    return data
+
+def writeCache(filename, data, st):
+    """Writes the contents data of a dungeon file to its binary cache, so the next load skips parsing the JSON.
+    The JSON file stays the only source of truth, the cache is just a compressed copy stamped with st, the os.stat of the file
+    taken before data was read from it. So a file changed while it was read gets a stale stamp and is read again next time."""
+    header = CACHEHEADER.pack(*_cacheStamp(st))
+    tmp = cacheFile(filename) + ".tmp"
+    f = open(tmp, "wb")
+    f.write(header + zlib.compress(marshal.dumps(data), 1))
+    f.close()
+    os.replace(tmp, cacheFile(filename))
+
 def loadData(filename, data):
-    data = json.load(open(filename))
-    data[1] = {int(k) : Table.fromDict(v) for k,v in data[1].items()}
+    # loading makes lots of small objects without cycles, the garbage collector would only walk over them again and again
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        st = os.stat(filename)
+        data = readCache(filename, st)
+        if data is None:
+            data = json.load(open(filename))
+            # json keys are strings, table ids are ints
+            data[1] = {int(k) : v for k,v in data[1].items()}
+            try:
+                writeCache(filename, data, st)
+            except OSError:
+                # e.g. a read only directory, the cache is only an optimization
+                pass
+    finally:
+        if collecting:
+            gc.enable()
+    # tables are only decoded when they are used, see LazyTables
+    data[1] = LazyTables(data[1])
     return data
 
+def writeAtomic(filename, w):
+    """Replaces filename with the string w, so that the file is either the old or the new one even if the program dies while writing."""
+    tmp = filename + ".tmp"
+    f = open(tmp, "w")
+    f.write(w)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(tmp, filename)
+
+def readJournal(filename):
+    """Generator over the records in a journal file, tuples of a record and the size of the journal up to the end of its line.
+    A record is a list of sequence number, kind, key and value. Stops at a line that was cut off."""
+    if not(os.path.isfile(filename)):
+        return
+    f = open(filename, "rb")
+    end = 0
+    for line in f:
+        if not(line.endswith(b"\n")):
+            # the program died while writing this line, nothing after it was saved
+            break
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        end += len(line)
+        yield (record, end)
+    f.close()
+
 class State(object):
     def blueprint(skills):
         return '[{"skills" : ' + str(skills).replace("'", '"') + ', "table_map" : {}, "current_room" : "0", "next_id": 1, "rooms" : {"0":{"id":"0", "name":"Entry Point"}}, "edges" : {"0" : {}}}, {}]'
     
     def fromFile(filename):
+        if isDatabase(filename):
+            return State.fromDatabase(filename)
         data = []
         data = loadData(filename, data)
-        return State(data, filename)
+        s = State(data, filename)
+        s._replay()
+        return s
+
+    def fromDatabase(filename):
+        # rooms, paths and tables are read when they are used and every save is a transaction, see sqlstore.py
+        (store, data, tables) = openDungeon(filename)
+        s = State([data, LazyTables(tables)], filename)
+        s._store = store
+        return s
 
     def __init__(self, data, filename):
         self.data = data[0]
         self.filename = filename
-        self.tables = data[1]
+        if isinstance(data[1], LazyTables):
+            self.tables = data[1]
+        else:
+            self.tables = LazyTables(tables=data[1])
 
         if not("next_id" in self.data):
             self.data["next_id"] = 1
@@ -68,16 +190,266 @@ class State(object):
             self.data["edges"] = {}
         if not("table_map" in self.data):
             self.data["table_map"] = {}
+        self._graph = None
+        # room id to the set of rooms with paths to it, see _incomingIndex
+        self._incoming = None
+        # for a database, the rooms whose paths were changed in memory, and per target room which of them have paths to it
+        self._changedSources = set()
+        self._changedFrom = {}
+        # per room direction to target index and look output, see _exitIndex
+        self._exits = {}
+        self._looks = {}
+        # target room id to shortest paths leading there, see _routeTree
+        self._routes = {}
+        # grid positions of rooms, made by the first map command, see layout.py
+        self._layout = None
+        # words in rooms, made by the first find command, see search.py
+        self._search = None
+        # every table rolls with its own child stream, see rng.py
+        self.rng = Stream()
+        self._streams = {}
+        # changes since the last save, see _touch. The journal holds everything saved after the dungeon file was written
+        self._pending = {}
+        self._seq = self.data.get("journal_seq", 0)
+        self._journalSize = 0
+        self._snapshotSize = 0
+        # old values of everything the current command changed, and lists of (command, old values) to undo and redo
+        self._group = {}
+        self._undo = []
+        self._redo = []
+        # set during bulk changes, which keep no old values, see beginBulk
+        self._bulk = False
+        # held while a command runs, so the autosave thread only sees whole commands
+        self.lock = threading.RLock()
+        self._ioLock = threading.Lock()
+        self._writes = queue.Queue()
+        # the database for dungeons stored in SQLite, None for JSON files
+        self._store = None
+        return
+
+    #########
+    # Saving: changes are appended to a journal next to the dungeon file, one record per changed room, table or value.
+    # The journal is replayed on load and merged into the dungeon file when it gets too big
+    #######
+
+    def _touch(self, kind, key):
+        # call this before changing something that is saved. kind is "data" for a top level value like current_room,
+        # "rooms", "edges" or "table_map" for one of their entries, or "tables" for a table. The record is written on the next save
+        self._pending[(kind, key)] = True
+        if kind == "edges":
+            self._edgesChanging(key)
+        if self._bulk:
+            return
+        if not((kind, key) in self._group):
+            self._group[(kind, key)] = copy.deepcopy(self._value(kind, key))
+        return
+
+    def _value(self, kind, key):
+        # the current value of what _touch refers to, None if it was deleted
+        if kind == "tables":
+            if key in self.tables:
+                return self.tables.encoded(key)
+            return None
+        if kind == "data":
+            return self.data.get(key)
+        return self.data[kind].get(key)
+
+    def _apply(self, kind, key, value):
+        # sets what _touch refers to, deleting it for a value of None
+        if kind == "tables":
+            if value is None:
+                self.tables.pop(key, None)
+            else:
+                self.tables.setEncoded(key, value)
+            self._tablesChanged()
+            return
+        if kind == "data":
+            self.data[key] = value
+            return
+        if kind == "edges":
+            self._edgesReplaced(key, value or {})
+            self._routes = {}
+        elif kind == "rooms":
+            self._forget(key)
+            if self._layout and (value is None):
+                self._layout.remove(key)
+            elif self._layout:
+                self._layout.touch(key)
+            if self._search:
+                self._search.drop(key)
+                if value is not None:
+                    self._search.setRoom(key, self._roomTexts(value))
+        if value is None:
+            self.data[kind].pop(key, None)
+        else:
+            self.data[kind][key] = value
+        return
+
+    def _replay(self):
+        # applies the journal records that are newer than the dungeon file
+        self._snapshotSize = os.path.getsize(self.filename)
+        end = 0
+        for ((seq, kind, key, value), end) in readJournal(journalFile(self.filename)):
+            if seq <= self._seq:
+                continue
+            self._apply(kind, key, value)
+            self._seq = seq
+        if os.path.isfile(journalFile(self.filename)):
+            self._journalSize = os.path.getsize(journalFile(self.filename))
+        if self._journalSize > end:
+            # records appended after a cut off line would never be read, so the broken rest goes
+            print("Warning: dropping a cut off record at the end of " + journalFile(self.filename) + ".")
+            os.truncate(journalFile(self.filename), end)
+            self._journalSize = end
+        return
+
+    #########
+    # Undo: every command keeps the old values of what it changed, so it can be rolled back
+    #######
+
+    def _restore(self, olds):
+        # sets everything back to olds and returns the values it replaced
+        news = {}
+        for ((kind, key), value) in olds.items():
+            news[(kind, key)] = copy.deepcopy(self._value(kind, key))
+            self._pending[(kind, key)] = True
+            self._apply(kind, key, value)
+        if not(self.data.get("current_room") in self.data["rooms"]) and self.data["rooms"]:
+            # the room we were in was undone. Without any rooms left current_room stays as it is
+            self.data["current_room"] = min(self.data["rooms"], key=int)
+            self._pending[("data", "current_room")] = True
+        return news
+
+    def endCommand(self, command):
+        """Closes the changes of a command so undo can take them back."""
+        group = self._group
+        self._group = {}
+        # walking around isn't worth undoing
+        if not(group) or (list(group) == [("data", "current_room")]):
+            return
+        self._undo.append((command, group))
+        if len(self._undo) > UNDOLIMIT:
+            del self._undo[0]
+        self._redo = []
+        return
+
+    def beginBulk(self):
+        """Starts a change too big to undo, like generating a dungeon. Changes are still saved, but their old values aren't copied."""
+        self._bulk = True
+        return
+
+    def endBulk(self):
+        self._bulk = False
+        self._group = {}
+        # older commands may not apply on top of the bulk change
+        self._undo = []
+        self._redo = []
+        return
+
+    def rollback(self):
+        """Takes back what the current command changed so far, e.g. when it failed."""
+        self._restore(self._group)
+        self._group = {}
+        return
+
+    def undo(self, args):
+        if not(self._undo):
+            print("Nothing to undo.")
+            return
+        (command, olds) = self._undo.pop()
+        self._redo.append((command, self._restore(olds)))
+        self._group = {}
+        print("Ok. Undid '" + command + "'.")
+        self._lookAfterRestore()
+        return
+
+    def redo(self, args):
+        if not(self._redo):
+            print("Nothing to redo.")
+            return
+        (command, news) = self._redo.pop()
+        self._undo.append((command, self._restore(news)))
+        self._group = {}
+        print("Ok. Redid '" + command + "'.")
+        self._lookAfterRestore()
         return
 
+    def _lookAfterRestore(self):
+        if self.data.get("current_room") in self.data["rooms"]:
+            self.look()
+        else:
+            print("No room left.")
+
     def save(self):
-        # note that json will turn dict keys into strings
-        s = [self.data, {k : v.toDict() for k,v in self.tables.items()}]
-        f = open(self.filename, "w")
-        json.dump(s, f)
-        f.flush()
-        f.close()
-        
+        """Appends the changes since the last save to the journal. Merges the journal into the dungeon file once it gets too big.
+        Can be called from the autosave thread, files are written without holding the lock."""
+        with self.lock:
+            self._collect()
+        self._writeAll()
+
+    def snapshot(self):
+        """Writes the whole dungeon to the dungeon file and empties the journal."""
+        if self._store:
+            # a database is always complete
+            return self.save()
+        with self.lock:
+            self._pending = {}
+            self._collectSnapshot()
+        self._writeAll()
+
+    def _collect(self):
+        # turns the pending changes into journal records, queued in order while holding the lock
+        if not(self._pending):
+            return
+        if self._store:
+            self._writes.put(("sql", [self._store.rows(kind, key, self._value(kind, key)) for (kind, key) in self._pending]))
+            self._pending = {}
+            return
+        lines = []
+        for (kind, key) in self._pending:
+            self._seq += 1
+            lines.append(json.dumps([self._seq, kind, key, self._value(kind, key)]) + "\n")
+        self._pending = {}
+        w = "".join(lines)
+        self._journalSize += len(w)
+        if self._journalSize > max(JOURNALMINSIZE, self._snapshotSize):
+            # the snapshot contains these records already
+            self._collectSnapshot()
+            return
+        self._writes.put(("journal", w))
+
+    def _collectSnapshot(self):
+        self.data["journal_seq"] = self._seq
+        # note that json will turn dict keys into strings. Like loading, this makes lots of objects without cycles, see loadData
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            w = json.dumps([self.data, {k : self.tables.encoded(k) for k in self.tables}])
+        finally:
+            if collecting:
+                gc.enable()
+        self._writes.put(("snapshot", w))
+        self._journalSize = 0
+        self._snapshotSize = len(w)
+
+    def _writeAll(self):
+        # writes queued records and snapshots in the order they were queued. Only one thread writes at a time
+        with self._ioLock:
+            while not(self._writes.empty()):
+                (kind, w) = self._writes.get()
+                if kind == "sql":
+                    self._store.write(w)
+                elif kind == "journal":
+                    f = open(journalFile(self.filename), "a")
+                    f.write(w)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    f.close()
+                else:
+                    writeAtomic(self.filename, w)
+                    # records up to journal_seq are skipped on load, so dying before this point loses nothing
+                    open(journalFile(self.filename), "w").close()
+        return
 
     def quit(self):
         self.save()
@@ -85,33 +457,45 @@ class State(object):
 
     def create(self, roomName):
         newRoom = { "id": str(self.data["next_id"]), "name" : roomName , 'skill_checks' : []}
+        self._touch("data", "next_id")
+        self._touch("rooms", newRoom["id"])
+        self._touch("edges", newRoom["id"])
+        self._forget(newRoom["id"])
         self.data["next_id"] += 1
         self.data["rooms"][newRoom["id"]] = newRoom
         self.data["edges"][newRoom["id"]] = {}
 
         if not("current_room" in self.data):
+            self._touch("data", "current_room")
             self.data["current_room"] = "1"
 
+        if self._search:
+            self._search.add(newRoom["id"], roomName)
         return newRoom
 
     def currentRoom(self):
         return self.data["rooms"][self.data["current_room"]]
 
 
-    def _currentExits(self):
-        room = self.currentRoom()
-        acc = []
-        exits = self.data["edges"][room["id"]]
-        for (r2, paths) in exits.items():
-            for path in paths:
-                acc.append(path) 
+    def _exitIndex(self, r):
+        # direction to target room for the paths going out from r, built when first needed and dropped by _forget
+        if not(r in self._exits):
+            exits = {}
+            for (r2, paths) in self.data["edges"][r].items():
+                for path in paths:
+                    # like following a path, the first room in that direction wins
+                    exits.setdefault(path, r2)
+            self._exits[r] = exits
+        return self._exits[r]
 
-        result = []
-        for d in directions:
-            if d in acc:
-                result.append(d)
+    def _forget(self, r):
+        # the paths going out from room r or the room itself are about to change
+        self._exits.pop(r, None)
+        self._looks.pop(r, None)
 
-        return result
+    def _currentExits(self):
+        exits = self._exitIndex(self.currentRoom()["id"])
+        return [d for d in directions if d in exits]
 
 
     def _edges(self, r):
@@ -144,9 +528,11 @@ class State(object):
 
     def shortDescription(self):
         room = self.currentRoom()
-        w = room["name"] + " : " + room["id"] + "\n"
-        w += self.exits()
-        return w
+        if not(room["id"] in self._looks):
+            w = room["name"] + " : " + room["id"] + "\n"
+            w += self.exits()
+            self._looks[room["id"]] = w
+        return self._looks[room["id"]]
         
     def look(self):
         print(self.shortDescription())
@@ -156,6 +542,7 @@ class State(object):
             print("Room not found.")
             return
             
+        self._touch("data", "current_room")
         self.data["current_room"] = id
 
 
@@ -164,6 +551,15 @@ class State(object):
             print("Room " + r1 + " does not seem to exist.")
             return
 
+        self._touch("edges", r1)
+        self._routesConnected(r1, r2, path)
+        if self._layout:
+            self._layout.touch(r1)
+            self._layout.touch(r2)
+        self._forget(r1)
+        self._incomingTo(r2).add(r1)
+        if self._store:
+            self._changedFrom.setdefault(r2, set()).add(r1)
         if not(r2 in self.data["edges"][r1]):
             self.data["edges"][r1][r2] = [path]
         else:
@@ -180,17 +576,16 @@ class State(object):
         self._connect(room1, room2, path)
         
     def follow(self, direction):
-        edges = self._currentEdges()
-        for (r1, r2, path) in edges:
-            if path == direction:
-                self.move(r2)
-                self.look()
-                return
-        print("No path in that direction.")
+        r2 = self._exitIndex(self.currentRoom()["id"]).get(direction)
+        if r2 is None:
+            print("No path in that direction.")
+            return
+        self.move(r2)
+        self.look()
         return
 
     def dig(self, direction):
-        if direction in self._currentExits():
+        if direction in self._exitIndex(self.currentRoom()["id"]):
             print("Path already exists.")
             return
 
@@ -199,6 +594,9 @@ class State(object):
         r2 = self.create(newname)["id"]
         self._connect(r1, r2, direction)
         self._connect(r2, r1, opposite(direction))
+        if self._layout and self._layout.position(r1):
+            # only the new room is placed, next to the one we dug from
+            self._layout.update(r2)
         self.follow(direction)
 
 
@@ -220,7 +618,13 @@ class State(object):
             print("Room two does not exist or is not connected.")
             return
 
+        self._touch("edges", r1)
+        self._routesDisconnected(r1, r2)
+        self._forget(r1)
         self.data["edges"][r1].pop(r2, None)
+        self._incomingTo(r2).discard(r1)
+        if self._store:
+            self._changedFrom.get(r2, set()).discard(r1)
             
     def free(self, args):
         if not(args):
@@ -236,16 +640,208 @@ class State(object):
             print("Room does not seem to exist!")
             return
 
+        self._touch("edges", r)
+        for target in list(self._routes):
+            if self._routes[target].get(r, (0, None, None))[2] is not None:
+                del self._routes[target]
+        self._edgesReplaced(r, {})
         self.data["edges"][r] = {}
         # now edges going to the room
+        for source in list(self._incomingTo(r)):
+            self._disconnect(source, r)
+
+    def _incomingIndex(self):
+        # the rooms with paths to every room, built from data["edges"] when first needed and kept up to date after that.
+        # For a database only the rooms asked for are loaded, see _incomingTo
+        if self._incoming is None:
+            self._incoming = {}
+            if self._store:
+                return self._incoming
+            for (source, targets) in self.data["edges"].items():
+                for target in targets:
+                    self._incoming.setdefault(target, set()).add(source)
+        return self._incoming
+
+    def _incomingTo(self, r):
+        # the set of rooms with paths to r
+        incoming = self._incomingIndex()
+        if not(r in incoming):
+            acc = set()
+            if self._store:
+                # saved paths, unless their room was changed since, and the changed rooms from memory
+                acc.update([u for u in self._store.sources(r) if not(u in self._changedSources)])
+                acc.update(self._changedFrom.get(r, ()))
+            incoming[r] = acc
+        return incoming[r]
+
+    def _edgesChanging(self, r):
+        # the paths going out from r are about to change. For a database they are indexed from now on, as the saved ones may be out of date
+        if not(self._store) or (r in self._changedSources):
+            return
+        self._changedSources.add(r)
+        for target in self.data["edges"].get(r, {}):
+            self._changedFrom.setdefault(target, set()).add(r)
+
+    def _edgesReplaced(self, r, targets):
+        # the paths going out from r are about to be replaced by targets
+        self._forget(r)
+        if self._store:
+            self._edgesChanging(r)
+            for target in self.data["edges"].get(r, {}):
+                self._changedFrom[target].discard(r)
+            for target in targets:
+                self._changedFrom.setdefault(target, set()).add(r)
+        if self._incoming is None:
+            return
+        for target in self.data["edges"].get(r, {}):
+            if target in self._incoming:
+                self._incoming[target].discard(r)
+        for target in targets:
+            self._incomingTo(target).add(r)
+
+    #########
+    # Routes: shortest paths to a room, found by a breadth first search backwards along the paths leading there.
+    # The result is cached per target room and only dropped when a change to the paths can alter it
+    #######
+
+    def _routeTree(self, target):
+        # room id to (distance, direction, next room) for every room that can reach target
+        if target in self._routes:
+            # most recently used targets go last, the first one is dropped when the cache is full
+            tree = self._routes.pop(target)
+            self._routes[target] = tree
+            return tree
+
+        tree = {target : (0, None, None)}
+        frontier = [target]
+        while frontier:
+            nextFrontier = []
+            for v in frontier:
+                dist = tree[v][0] + 1
+                for u in self._incomingTo(v):
+                    if u in tree:
+                        continue
+                    # only directions that follow would take to v
+                    exits = self._exitIndex(u)
+                    ds = [d for d in self.data["edges"][u][v] if exits.get(d) == v]
+                    if ds:
+                        tree[u] = (dist, ds[0], v)
+                        nextFrontier.append(u)
+            frontier = nextFrontier
+
+        self._routes[target] = tree
+        if len(self._routes) > ROUTECACHESIZE:
+            del self._routes[next(iter(self._routes))]
+        return tree
+
+    def _routesConnected(self, u, v, path):
+        # a path from u to v is about to be added. Only routes that can now go through it are dropped
+        if not(self._routes) or (path in self._exitIndex(u)):
+            # no routes cached, or follow would still take the older path in that direction
+            return
+        for (target, tree) in list(self._routes.items()):
+            if (v in tree) and (not(u in tree) or (tree[v][0] + 1 < tree[u][0])):
+                del self._routes[target]
+
+    def _routesDisconnected(self, u, v):
+        # the paths from u to v are about to be removed. Only routes that went through them are dropped
+        for (target, tree) in list(self._routes.items()):
+            if (u in tree) and (tree[u][2] == v):
+                del self._routes[target]
+        # a direction that led to v may lead to another room now
+        shadowed = [d for (d, r2) in self._exitIndex(u).items() if r2 == v]
+        others = [x for (x, paths) in self.data["edges"][u].items() if (x != v) and any([d in paths for d in shadowed])]
+        for x in others:
+            for (target, tree) in list(self._routes.items()):
+                if x in tree:
+                    del self._routes[target]
+
+    def _route(self, r1, r2):
+        # directions leading from r1 to r2, None if there is no way
+        tree = self._routeTree(r2)
+        if not(r1 in tree):
+            return None
         acc = []
-        for(source, rd2) in self.data["edges"].items():
-            for target in rd2.keys():
-                if target == r:
-                    acc.append((source, target))
+        while r1 != r2:
+            (dist, d, r1) = tree[r1]
+            acc.append(d)
+        return acc
 
-        for (source, target) in acc:
-            self._disconnect(source, target)
+    def _routeFromArgs(self, args):
+        if not(args):
+            print("Please specify a room id.")
+            return None
+        r = args[0]
+        if not(r in self.data["rooms"]):
+            print("Room not found.")
+            return None
+        route = self._route(self.currentRoom()["id"], r)
+        if route is None:
+            print("No way leads from here to " + self.data["rooms"][r]["name"] + ".")
+        return route
+
+    def route(self, args):
+        route = self._routeFromArgs(args)
+        if route is None:
+            return
+        if not(route):
+            print("You are already there.")
+            return
+        print(str(len(route)) + " step(s): " + ", ".join(route))
+
+    def goto(self, args):
+        route = self._routeFromArgs(args)
+        if route is None:
+            return
+        if route:
+            print("Going " + ", ".join(route) + ".")
+        self.move(args[0])
+        self.look()
+
+    def _layoutNeighbours(self, r):
+        # rooms lying in a direction from r, by paths going out from r or coming in to it
+        for (d, r2) in self._exitIndex(r).items():
+            yield (d, r2)
+        for source in self._incomingTo(r):
+            for d in self.data["edges"][source][r]:
+                if d in directions:
+                    yield (opposite(d), source)
+
+    def layout(self):
+        """The grid positions of the rooms, see layout.py. Made when first needed and kept up to date after that."""
+        if self._layout is None:
+            self._layout = Layout(self._layoutNeighbours)
+        return self._layout
+
+    def showMap(self, args):
+        if args and args[0].isnumeric():
+            radius = int(args[0])
+        else:
+            radius = MAPRADIUS
+        r = self.currentRoom()["id"]
+        self.layout().update(r, radius)
+        print(renderMap(self._layout, r, radius, self._exitIndex))
+
+    def predecessors(self, r):
+        """Ids of the rooms that have a path leading to room r."""
+        return sorted(self._incomingTo(r), key=int)
+
+    def leadsHere(self, args):
+        if args:
+            r = args[0]
+        else:
+            r = self.currentRoom()["id"]
+        if not(r in self.data["rooms"]):
+            print("Room not found.")
+            return
+
+        sources = self.predecessors(r)
+        if not(sources):
+            print("No paths lead to " + self.data["rooms"][r]["name"] + ".")
+            return
+        for source in sources:
+            name = self.data["rooms"].get(source, {}).get("name", "Unknown room")
+            print(name + " : " + source + " (" + ", ".join(self.data["edges"][source][r]) + ")")
 
 
     def _deleteRoom(self, r):
@@ -255,6 +851,13 @@ class State(object):
 
         self._free(r)
         self._tableDeleteRoom(r)
+        self._touch("rooms", r)
+        self._forget(r)
+        self._routes.pop(r, None)
+        if self._layout:
+            self._layout.remove(r)
+        if self._search:
+            self._search.drop(r)
         del self.data["rooms"][r]
 
     def deleteRoom(self, args):
@@ -274,6 +877,7 @@ class State(object):
                     return
                 else:
                     # we create a room since there is no other
+                    self._touch("data", "next_id")
                     self.data["next_id"] = 1
                     newRoom = self.create("Saferoom")
                     self.move(newRoom["id"])
@@ -292,12 +896,56 @@ class State(object):
             print("Room does not exist.")
             return
             
+        self._touch("rooms", r)
+        if self._search:
+            self._search.add(r, w)
         if not("notes" in self.data["rooms"][r]):
             self.data["rooms"][r]["notes"] = [w]
             return
 
         self.data["rooms"][r]["notes"].append(w)
 
+    #########
+    # Search: an inverted index over the texts of every room, built by the first find and updated with every change after that
+    #######
+
+    def _roomTexts(self, room):
+        # everything in a room that can be searched for
+        acc = [room["name"], room.get("description", "")] + room.get("notes", [])
+        for skillCheck in room.get("skill_checks", []):
+            # name, description, success and failure
+            acc += [w for w in skillCheck[2:] if isinstance(w, str)]
+        return acc
+
+    def _searchChanged(self, r):
+        # reindexes a room after some of its texts were removed or replaced
+        if self._search:
+            self._search.setRoom(r, self._roomTexts(self.data["rooms"][r]))
+
+    def find(self, args):
+        if not(args):
+            print("Please specify words to search for.")
+            return
+        if self._search is None:
+            self._search = SearchIndex()
+            for (r, room) in self.data["rooms"].items():
+                self._search.setRoom(r, self._roomTexts(room))
+
+        query = " ".join(args)
+        matches = self._search.find(query)
+        if not(matches):
+            print("Nothing found.")
+            return
+        ws = set(words(query))
+        for (score, r) in matches:
+            room = self.data["rooms"][r]
+            # the first text with one of the words, so you can see why the room matched
+            hits = [w for w in self._roomTexts(room)[1:] if ws.intersection(words(w))]
+            w = room["name"] + " : " + r
+            if hits:
+                w += " - " + hits[0].strip().split("\n")[0][:60]
+            print(w)
+
     def _getNotes(self, r):
         return self.data["rooms"].get(r, []).get("notes", [])
 
@@ -335,7 +983,9 @@ class State(object):
             print("Wrong note number.")
             return
 
+        self._touch("rooms", r)
         del self.data["rooms"][r]["notes"][n]
+        self._searchChanged(r)
 
     def deleteNote(self, args):
         # we only do this in the current room, otherwise its too confusing with the numbers
@@ -366,7 +1016,9 @@ class State(object):
             print("Room does not seem to exist.")
             return
 
+        self._touch("rooms", r)
         self.data["rooms"][r]["description"] = w
+        self._searchChanged(r)
 
     def setDescription(self, args):
         r = self.currentRoom()["id"]
@@ -385,10 +1037,31 @@ class State(object):
     def showDescription(self):
         print(self.currentRoom().get("description", "No Description."))
         return
+    def _tableGraph(self):
+        # compiled references between tables, see tablegraph.py
+        if (self._graph is None) or not(self._graph.tables is self.tables):
+            self._graph = TableGraph(self.tables)
+        return self._graph
+
+    def _tablesChanged(self):
+        # tables were added or removed, references may resolve differently now
+        self._tableGraph().invalidate()
+        return
+
+    def _tableLeaves(self, tableId):
+        # outcome probabilities through referenced tables, None if the table references none
+        if not(self.tables[tableId].references()):
+            return None
+        return self._tableGraph().leaves(tableId)
+
+    def _tableStream(self, tableId):
+        if not(tableId in self._streams) or not(self._streams[tableId].rootSeed == self.rng.rootSeed):
+            self._streams[tableId] = self.rng.split(("table", tableId))
+        return self._streams[tableId]
+
     def _tableNextId(self):
-        ks = sorted(self.tables.keys())
-        if ks:
-            return ks[-1] + 1
+        if self.tables:
+            return max(self.tables) + 1
         return 1
 
     def _tableMapToRoom(self, tableId, roomId):
@@ -402,6 +1075,7 @@ class State(object):
             return
         
         tm = self.data["table_map"]
+        self._touch("table_map", roomId)
         if roomId in tm:
             ts = tm[roomId]
             if tableId in ts:
@@ -431,6 +1105,7 @@ class State(object):
         ts = tm[roomId]
         if not(tableId in ts):
             return (False, "Table is not part of room. Nothing removed.")
+        self._touch("table_map", roomId)
         tm[roomId] = list(filter(lambda id: id != tableId, ts))
         return (True, "")
 
@@ -438,13 +1113,16 @@ class State(object):
         # called because a room is being deleted, dropds a room entry from the table mapping
         tm = self.data["table_map"]
         if roomId in tm:
+            self._touch("table_map", roomId)
             del tm[roomId]
         return
     
     def tableNew(self, args):
         t = mkTableDialogue()
         id = self._tableNextId()
+        self._touch("tables", id)
         self.tables[id] = t
+        self._tablesChanged()
         
         # if no arg, add table to current room
         if len(args) == 0:
@@ -459,22 +1137,24 @@ class State(object):
                 else:
                     self._tableMapToRoom(id, n) #self.data["table_map"][n] = id
                     
-        editTableDialogue(t)
+        editAnyTableDialogue(t, lambda: self._tableLeaves(id))
         return
 
 
-    def _tableList(self, tableItems):
+    def _tableList(self, tableIds):
+        # tables that weren't used stay encoded, see LazyTables.listing
         print("Id\tName\tType\tDescription")
         w = ""
-        for (id, t) in tableItems:
+        for id in tableIds:
+            (name, type, description) = self.tables.listing(id)
             w += str(id) + "\t"
-            w += t.name() + "\t"
-            w += t.type() + "\t"
-            w += t.description() + "\n"
+            w += name + "\t"
+            w += type + "\t"
+            w += description + "\n"
         return w
     
     def tableGlobalList(self, args):
-        print(self._tableList(self.tables.items()))
+        print(self._tableList(self.tables))
         return
 
     def _tableDelete(self, tableId):
@@ -485,7 +1165,9 @@ class State(object):
             self._tableMapRemoveFromRoom(tableId, roomId)
 
         if tableId in self.tables:
+            self._touch("tables", tableId)
             del self.tables[tableId]
+            self._tablesChanged()
         return
     
     def tableDelete(self, args):
@@ -507,26 +1189,42 @@ class State(object):
         if not(tableId in self.tables):
             print("Error: Could not roll on table. No table with id " + str(tableId) + ".")
             return ""
-        return self.tables[tableId].roll()
+        cycle = self._tableGraph().findCycle(tableId)
+        if cycle:
+            print("Error: Could not roll on table. Tables reference each other in a cycle: " + " -> ".join(map(str, cycle)))
+            return ""
+        t = self.tables[tableId]
+        if t.isDeck():
+            self._touch("tables", tableId)
+            w = t.draw(self._tableStream(tableId))
+            if w is None:
+                print("The deck of '" + t.name() + "' is empty. Use tshuffle to reshuffle.")
+                return ""
+            return self._tableResolve(w)
+        w = self._tableGraph().roll(tableId, self._tableStream(tableId))
+        r = tableReference(w)
+        if (r is not None) and (r in self.tables) and self.tables[r].isDeck():
+            # the roll got to a table in deck mode, which draws a card
+            return self._tableRoll(r)
+        return w
         
 
         
-    def tableRoll(self, args):
-        # roll on table in room if no arg
-        tm = self.data["table_map"]
+    def _tableFromArgs(self, args, prompt):
+        # table id from args, or from the current room if no args. None if there is no valid table
         if not(args):
             roomId = self.currentRoom()["id"]
             ts = self._tablesForRoom(roomId)
             if not(ts):
-                print("Room has no tables. Please specify a table ID (see tgl command) to roll on a table.")
-                return
+                print("Room has no tables. Please specify a table ID (see tgl command).")
+                return None
             elif len(ts) > 1:
                 # give a selection
-                print(self._tableList([(tid, self.tables[tid]) for tid in ts]))
-                inp = input("Pick a table to roll on:")
+                print(self._tableList(ts))
+                inp = input(prompt)
                 if not(inp.isnumeric()):
                     print("Please specify a valid table id.")
-                    return
+                    return None
                 tableId = int(inp)
             else:
                 # only one table in room
@@ -534,20 +1232,96 @@ class State(object):
         else: # argument was specified
             if not(args[0].isnumeric()):
                 print("Please specify a table id as argument.")
-                return
+                return None
             tableId = int(args[0])
-            if not(tableId in self.tables):
-                print("No such table with id " + str(tableId) + ".")
-                return
+
+        if not(tableId in self.tables):
+            print("No such table with id " + str(tableId) + ".")
+            return None
+        return tableId
+
+    def tableRoll(self, args):
+        # roll on table in room if no arg
+        tableId = self._tableFromArgs(args, "Pick a table to roll on:")
+        if tableId is None:
+            return
 
         # finally, all checks out
         print(self.tables[tableId].name() + ": " + self._tableRoll(tableId) )
         return
+
+    def _tableResolve(self, w):
+        # an entry drawn from a deck may still reference another table
+        r = tableReference(w)
+        if r is None:
+            return w
+        return self._tableRoll(r)
+
+    def _deckTableFromArgs(self, args, prompt):
+        # like _tableFromArgs, for commands that only work on dice tables
+        tableId = self._tableFromArgs(args, prompt)
+        if (tableId is not None) and isinstance(self.tables[tableId], WeightedTable):
+            print("Deck mode only works with dice tables, '" + self.tables[tableId].name() + "' is a weighted table.")
+            return None
+        return tableId
+
+    def tableDraw(self, args):
+        tableId = self._deckTableFromArgs(args, "Pick a table to draw from:")
+        if tableId is None:
+            return
+        t = self.tables[tableId]
+        self._touch("tables", tableId)
+        if not(t.isDeck()):
+            print("Table '" + t.name() + "' is now in deck mode. Every entry comes up once until you reshuffle with tshuffle.")
+        w = t.draw(self._tableStream(tableId))
+        if w is None:
+            print("The deck of '" + t.name() + "' is empty. Use tshuffle to reshuffle.")
+            return
+        print(t.name() + ": " + self._tableResolve(w) + " (" + str(t.deckSize()) + " left)")
+        return
+
+    def tablePeek(self, args):
+        tableId = self._deckTableFromArgs(args, "Pick a table to peek at:")
+        if tableId is None:
+            return
+        t = self.tables[tableId]
+        self._touch("tables", tableId)
+        w = t.peek(self._tableStream(tableId))
+        if w is None:
+            print("The deck of '" + t.name() + "' is empty. Use tshuffle to reshuffle.")
+            return
+        print(t.name() + ", next card: " + w + " (" + str(t.deckSize()) + " left)")
+        return
+
+    def tableShuffle(self, args):
+        tableId = self._deckTableFromArgs(args, "Pick a table to reshuffle:")
+        if tableId is None:
+            return
+        t = self.tables[tableId]
+        self._touch("tables", tableId)
+        t.reshuffle()
+        print("Ok. Deck of '" + t.name() + "' reshuffled, " + str(t.deckSize()) + " cards.")
+        return
+
+    def tableDeck(self, args):
+        tableId = self._deckTableFromArgs(args, "Pick a table to switch deck mode for:")
+        if tableId is None:
+            return
+        t = self.tables[tableId]
+        self._touch("tables", tableId)
+        t.setDeck(not(t.isDeck()))
+        if t.isDeck():
+            print("Ok. Table '" + t.name() + "' is in deck mode, tr draws from the deck.")
+        else:
+            print("Ok. Table '" + t.name() + "' rolls normally again.")
+        return
+
     def _tableEdit(self, tableId):
         if not(tableId in self.tables):
             print("Error: Cannot edit table. Table with id " + str(tableId) + " not found.")
             return
-        editTableDialogue(self.tables[tableId])
+        self._touch("tables", tableId)
+        editAnyTableDialogue(self.tables[tableId], lambda: self._tableLeaves(tableId))
         return
 
     def tableEdit(self, args):
@@ -559,7 +1333,7 @@ class State(object):
                 return
             elif len(ts) > 1:
                 # more than 1 table, offer a choice
-                self._tableList([(tid, self.tables[tid]) for tid in ts])
+                self._tableList(ts)
                 inp = input("More than 1 table in room. Specify id to edit:")
                 if not(inp.isnumeric()):
                     print("Not a valid table id.")
@@ -612,7 +1386,7 @@ class State(object):
                 print("No tables to remove from this room. Specify arguments to remove specific table from specific room")
                 return
             elif len(ts) > 1:
-                print(self._tableList([(tid, self.tables[tid]) for tid in ts]))
+                print(self._tableList(ts))
                 inp = input("Pick a table to remove from this room:") # is processed later
             else: # ts has exactly one element
                 tableId = ts[0]
@@ -638,6 +1412,31 @@ class State(object):
         print("Ok. Table '" + self.tables[tableId].name() + "' removed from room " + roomId + ".")
         return
 
+    def _tableImport(self, filename):
+        # adds all tables from an org-mode or CSV file, see tableimport.py. Returns the number of tables added
+        n = 0
+        nextId = self._tableNextId()
+        for t in readTables(filename):
+            # store them encoded, they are decoded again when used
+            self._touch("tables", nextId)
+            self.tables.setEncoded(nextId, t.toDict())
+            nextId += 1
+            n += 1
+        self._tablesChanged()
+        return n
+
+    def tableImport(self, args):
+        if not(args):
+            print("Please specify an org-mode or CSV file to import tables from.")
+            return
+        filename = " ".join(args)
+        if not(os.path.isfile(filename)):
+            print("Error: Could not find file '" + filename + "'.")
+            return
+        n = self._tableImport(filename)
+        print("Ok. " + str(n) + " table(s) imported. See tgl for the list of tables.")
+        return
+
     def tableList(self, args):
         if not(args):
             roomId = self.currentRoom()["id"]
@@ -651,7 +1450,7 @@ class State(object):
         if not(self._tablesForRoom(roomId)):
             print("No tables for " + self.data["rooms"][roomId]["name"] + ".")
             return
-        print(self._tableList([(tid, self.tables[tid]) for tid in self._tablesForRoom(roomId)]))
+        print(self._tableList(self._tablesForRoom(roomId)))
         return
 
     def _skillAdd(self, roomId, skillCheckList):
@@ -666,7 +1465,11 @@ class State(object):
             print("Not a valid skill identifier.")
             return
 
+        self._touch("rooms", roomId)
         self.data["rooms"][roomId]["skill_checks"].append(skillCheckList)
+        if self._search:
+            for w in skillCheckList[2:]:
+                self._search.add(roomId, w)
         return
 
     def _skillRemove(self, roomId, i):
@@ -678,7 +1481,9 @@ class State(object):
             print("Could not remove skill: index out of bounds.")
             return
 
+        self._touch("rooms", roomId)
         del skillChecks[i]
+        self._searchChanged(roomId)
         return
 
     def _skill(self, skillKey):
@@ -791,17 +1596,23 @@ def numRooms(s):
 def transferTables(s1, s2):
     """Adds tables from s1 state S1 to state S2. Does not maintain table mappings, or table Ids. Does not add table from S1 if a table in S2 is present with the same name and type."""
     if not(s2.tables):
+        for k in s1.tables:
+            s2._touch("tables", k)
         s2.tables = s1.tables
+        s2._tablesChanged()
         return
 
-    for (_, t1) in s1.tables.items():
-        add = True
-        for (_, t2) in s2.tables.items():
-            if (t1.name() == t2.name()) and (t1.type() == t2.type()):
-                add = False
-                break
-        if add:
-            s2.tables[s2._tableNextId()] = t1
+    # compare by name and type without decoding the tables, duplicates are skipped entirely
+    present = set([s2.tables.describe(k) for k in s2.tables])
+    nextId = s2._tableNextId()
+    for k in list(s1.tables):
+        key = s1.tables.describe(k)
+        if not(key in present):
+            s2._touch("tables", nextId)
+            s2.tables.setEncoded(nextId, s1.tables.encoded(k))
+            present.add(key)
+            nextId += 1
+    s2._tablesChanged()
     return 
 
 ########
@@ -816,6 +1627,10 @@ commands_full = {
     "l" : (["Look. Give a short description of the current room."],lambda s, ws: s.look()),
     "move" : (["ROOMID", "Move to another room by number."], lambda s, ws: s.move(ws[0])),
     "connect" : (["ROOMID1", "ROOMID2","PATH","Connects two rooms by a path. Will create a path from room with ROOMID1 to room with ROOMID2. Path can be the usual n,e,s,w,up,down,ne,se,sw,nw etc."], lambda s, ws: s.connect(ws)),
+    "from" : (["[ROOMID]", "List the rooms with paths leading to the current room, or to room with ROOMID, and the directions of those paths."], lambda s, ws: s.leadsHere(ws)),
+    "map" : (["[RADIUS]", "Draw a map of the rooms around the current room, RADIUS rooms in every direction (default 3). Rooms are laid out on a grid from the directions of their paths, every level on its own."], lambda s, ws: s.showMap(ws)),
+    "route" : (["ROOMID", "Print the shortest sequence of directions leading from the current room to room with ROOMID."], lambda s, ws: s.route(ws)),
+    "goto" : (["ROOMID", "Walk the shortest way from the current room to room with ROOMID."], lambda s, ws: s.goto(ws)),
     "disconnect" : (["ROOMID1","ROOMID2","Remove paths between rooms. Will remove all paths going from room with ROOMID1 to room with ROOMID2."], lambda s, ws: s.disconnect(ws)),
     "free" : (["[ROOMID[","Removes all paths going out from a room. If no argument is specified, frees the curren room from paths, otherwise will free room with ROOMID."], lambda s, ws: s.free(ws)),
     "delete" : (["[ROOMID]","Completely erases a room. This removes all the rooms paths, going in and out, as well as all descriptions and other contents. Will delete the current room if no argument is specified, room with ROOMID otherwise."], lambda s, ws: s.deleteRoom(ws)),
@@ -823,15 +1638,23 @@ commands_full = {
     "note" : (["[WORDS]", "Same as 'a'."], lambda s, ws: s.makeNote(ws)),
     "r" : (["[ROOMID]", "Read notes for a room. Specify by ROOMID argument, or no argument for current room."], lambda s, ws: s.readNotes(ws)),
     "dnote" : (["ROOMID", "NOTEID", "Delete a note from a room. First argument specifies the room, the second argument specifies the number of the note in that room. You can see the notenumber/id by using 'r'. You must specify both arguments explicitly."], lambda s, ws: s.deleteNote(ws)),
+    "find" : (["WORDS", "Find the rooms whose name, description, notes or skill checks contain WORDS, best matches first."], lambda s, ws: s.find(ws)),
     "d" : (["Show long description of current room."], lambda s, ws: s.showDescription()),
     "sd" : (["[WORDS]", "Set the description for the current room. If arguments are specified, they are used as a one liner description. Otherwise, a multi line edit mode is entered. Finish the description with two newlines."], lambda s, ws: s.setDescription(ws)),
-    "tn" : (["[ROOMID]", "Table new. Create a new table. If no argument is specified, will add that table to the current room. If ROOMID is specified and positive, will connect that table to the room with ROOMID, if negative, will not connect table with any room (it's in the global list, see tgl)"], lambda s, ws: s.tableNew(ws)),
+    "tn" : (["[ROOMID]", "Table new. Create a new table, either rolled with dice or with weighted entries. If no argument is specified, will add that table to the current room. If ROOMID is specified and positive, will connect that table to the room with ROOMID, if negative, will not connect table with any room (it's in the global list, see tgl)"], lambda s, ws: s.tableNew(ws)),
     "tgl" : (["Table global list. List all tables and their id."], lambda s, ws: s.tableGlobalList(ws)),
     "tdelete" : (["TABLEID", "Table delete. Removes a table based on id (see tgl). Removes all contents of the table and all references to the table from rooms."], lambda s, ws: s.tableDelete(ws)),
     "tr" : (["[TABLEID]", "Table roll. Rolls on the table in the current room if TABLEID is not specified. If it is specified, rolls on that table. If the current room has multiple tables you will be given a selection."], lambda s, ws: s.tableRoll(ws)),
-    "te" : (["[TABLEID]", "Table edit. If no argument is specified, will pick table from current room. Otherwise, opens edit dialogue for specified TABLEID."], lambda s, ws: s.tableEdit(ws)),
+    "te" : (["[TABLEID]", "Table edit. If no argument is specified, will pick table from current room. Otherwise, opens edit dialogue for specified TABLEID. An entry of the form @TABLEID rolls on that table instead."], lambda s, ws: s.tableEdit(ws)),
     "ta" : (["TABLEID", "[ROOMID]", "Table add. Adds an existing table, specified by TABLEID, to a room. If ROOMID is specified, add table to that room if it exists, otherwise, adds table to the current room."], lambda s, ws: s.tableAdd(ws)),
     "tremove" : (["[TABLEID | TABLEID ROOMID]", "Table remove. Removes a table from a room, though the table itself remains in the global list. If no arguments are specified, tries to find a table in the current room and remove it. If TABLEID is specified on its own, tries to remove a table with that id from the current room. If both TABLEID and ROOMID are specified, tries to remove the specified table from the specified room."], lambda s, ws: s.tableRemove(ws)),
+    "tdraw" : (["[TABLEID]", "Table draw. Draws an entry from a table like from a deck of cards, every entry comes up at most once until the deck is reshuffled. Turns on deck mode for the table. Picks the table from the current room if TABLEID is not specified."], lambda s, ws: s.tableDraw(ws)),
+    "tpeek" : (["[TABLEID]", "Table peek. Shows the entry that the next tdraw will give, without drawing it."], lambda s, ws: s.tablePeek(ws)),
+    "tshuffle" : (["[TABLEID]", "Table shuffle. Puts all drawn entries back into the deck of a table."], lambda s, ws: s.tableShuffle(ws)),
+    "tdeck" : (["[TABLEID]", "Table deck. Switches deck mode on or off for a table. In deck mode tr draws from the deck instead of rolling."], lambda s, ws: s.tableDeck(ws)),
+    "timport" : (["FILE", "Table import. Adds every table found in FILE to the global list of tables. FILE is an org-mode file, where every heading with a list of lines or an org table below it is a table, or a CSV file with TABLE,ENTRY or TABLE,RANGE,ENTRY rows. The die is picked from the number of entries."], lambda s, ws: s.tableImport(ws)),
+    "undo" : (["Undo the last command that changed the dungeon. Can be repeated."], lambda s, ws: s.undo(ws)),
+    "redo" : (["Redo the last undone command."], lambda s, ws: s.redo(ws)),
     "tl" : (["[ROOMID]", "Table list. List tables for a specific room. If ROOMID is not specified, lists tables for the current room. For a global list of tables, see tgl."], lambda s, ws: s.tableList(ws)),
         "sa" : (["Skillcheck Add. Add a skillcheck to the current room. Includes name, dc, description, success and failure states. All parameters acquired via prompt."], lambda s, ws: s.skillAdd(ws)),
             "sl" : (["Skillcheck list. List all skillchecks in current room."], lambda s, ws: s.skillList(ws)),
@@ -868,7 +1691,7 @@ def mkHelp():
         
 
 def mkProgramHelp():
-    out = "dungeme.py - Dungeon control system\nUsage: dungeme.py [OPTIONS] DUNGEONFILE\n\nOptions\n -c - Create a new empty DUNGEONFILE, do not open an existing one.\n -t, --merge-tables TABLEFILE - Merges all tables found in TABLEFILE into DUNGEONFILE before opening DUNGEONFILE. Does not replace tables or add duplicates. TABLEFILE is a regular dungeon file.\n --help - Print this help.\n\nIf a dungeonfile is specified, dungeme will enter into editor mode with the following commands:\n" + mkHelp()
+    out = "dungeme.py - Dungeon control system\nUsage: dungeme.py [OPTIONS] DUNGEONFILE\n\nOptions\n -c - Create a new empty DUNGEONFILE, do not open an existing one.\n -t, --merge-tables TABLEFILE - Merges all tables found in TABLEFILE into DUNGEONFILE before opening DUNGEONFILE. Does not replace tables or add duplicates. TABLEFILE is a regular dungeon file.\n -i, --import-tables FILE - Imports all tables from the org-mode or CSV file FILE into DUNGEONFILE before opening it, see the timport command.\n --seed SEED - Seed for all table rolls, so a session can be replayed. Every table rolls with its own stream derived from SEED.\n --autosave SECONDS - Save changes at most every SECONDS seconds in the background, default 5.\n --help - Print this help.\n\nChanges are saved in the background to DUNGEONFILE.journal, at most every SECONDS seconds of --autosave, and the journal is merged into DUNGEONFILE when it grows large. Quitting, also with Ctrl-D or Ctrl-C, saves all changes. If dungeme is killed, the changes of the last SECONDS seconds may be lost, use --autosave 0 to save right after every command.\nA DUNGEONFILE ending in .db or .sqlite is a SQLite database, rooms and tables are only read from it when they are used. sqlstore.py converts dungeon files to databases and back. generate.py adds procedurally generated rooms to a dungeon.\n\nIf a dungeonfile is specified, dungeme will enter into editor mode with the following commands:\n" + mkHelp()
     return out
 
 def getSkillDictFromFile(skillfile):
@@ -885,13 +1708,21 @@ def getSkillDictFromFile(skillfile):
 
 
 def createDungeonfile(file, skillfile=None):
-    f = open(file, "w")
     if skillfile:
         skills = getSkillDictFromFile(skillfile)
     else:
         skills = DEFAULTSKILLDICT
-        
+
+    if isDatabase(file):
+        (data, tables) = json.loads(State.blueprint(skills))
+        writeDungeon(file, data, tables)
+        return
+
+    f = open(file, "w")
     f.write(State.blueprint(skills))
+    # a journal left over from an earlier dungeon of the same name would be replayed on top of the new one
+    if os.path.isfile(journalFile(file)):
+        os.remove(journalFile(file))
 
     f.flush
     
@@ -900,6 +1731,24 @@ def main(argv):
     if (len(argv) == 1) or ((len(argv) > 1) and (argv[1] == "--help")):
         print(mkProgramHelp())
         return
+
+    interval = AUTOSAVEINTERVAL
+    if "--autosave" in argv:
+        i = argv.index("--autosave")
+        if (len(argv) <= i + 1) or not(argv[i + 1].isnumeric()):
+            print("Please specify a number of seconds between autosaves.")
+            return
+        interval = int(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+
+    seed = None
+    if "--seed" in argv:
+        i = argv.index("--seed")
+        if (len(argv) <= i + 1) or not(argv[i + 1].isnumeric()):
+            print("Please specify a number as seed.")
+            return
+        seed = int(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
     file = argv[-1]
     
     # for creating empty dungeonfile
@@ -928,22 +1777,50 @@ def main(argv):
         print("Merging tables...")
         transferTables(tableState, state)
 
+    if (len(argv) > 2) and ((argv[1] == "-i") or (argv[1] == "--import-tables")):
+        importFile = argv[2]
+        if not(os.path.isfile(importFile)):
+            print("Error: Could not find file '" + importFile + "' to import tables from.")
+            return
+        print("Importing tables...")
+        print(str(state._tableImport(importFile)) + " table(s) imported.")
+
+    # merged or imported tables, undo takes them back as one command
+    state.endCommand(" ".join(argv[1:3]))
+    state.save()
+
+    if seed is not None:
+        state.rng = Stream(seed)
 
     print("Ok. " + str(numRooms(state)) + " room(s) loaded. Enter command. Type 'h' for help.")
-    while(True):
-        backup = copy.deepcopy(state)
-        w = input()
-        if w:
-            ws = w.split()
-            if ws[0] in commands:
-                try:
-                    commands[ws[0]](state, ws[1:])
-                except:
-                    backup.save()
-                    raise
-                    
-            else:
-                print("Unrecognized command.")
+    # saves off the input loop, see autosave.py
+    autosave = Autosave(state, interval)
+    autosave.start()
+    try:
+        while(True):
+            try:
+                w = input()
+            except (EOFError, KeyboardInterrupt):
+                state.quit()
+            if w:
+                ws = w.split()
+                if ws[0] in commands:
+                    with state.lock:
+                        try:
+                            commands[ws[0]](state, ws[1:])
+                        except:
+                            # save the dungeon as it was before the command
+                            state.rollback()
+                            state.save()
+                            raise
+                        state.endCommand(w)
+                    autosave.notify()
+
+                else:
+                    print("Unrecognized command.")
+    finally:
+        # quit saved everything and left the lock, so the thread ends after at most one more save
+        autosave.stop()
         
 
 if (__name__ == "__main__"):
@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+#
+# generate.py
+#
+# Procedural dungeon generator. Rooms are made with State.create and joined both ways with State._connect, like dig does,
+# but in bulk without the prompts and undo of commands, so even a million rooms take seconds. Rooms lie on the grid of the
+# map command, around the rooms already there, so it draws them as they were dug. Also a source of big, realistic dungeons for benchmarks.
+
+import os.path
+import sys
+import gc
+import time
+from collections import deque
+from math import isqrt
+from dungeme import State, opposite, createDungeonfile, numRooms
+from layout import OFFSETS
+from rng import Stream
+from compact import CompactDungeon
+
+HELPTEXT = """generate.py - Procedural dungeon generator
+Usage: generate.py DUNGEONFILE [OPTIONS]
+
+Adds generated rooms to DUNGEONFILE, starting from its current room. DUNGEONFILE is created if it does not exist.
+
+Options
+  --algorithm ALGORITHM - How rooms are laid out, default walk
+      walk - a digger wandering around and digging corridors and halls
+      maze - a grid of rooms joined by a random spanning tree, with levels if --levels is given
+      caves - irregular caves on several levels, joined by paths up and down
+  --rooms N - Number of rooms to generate, default 1000
+  --levels N - Number of levels for maze and caves, default 1 for maze and 3 for caves
+  --loops P - Chance of joining rooms that are next to each other but not yet connected, default 0.1
+  --seed SEED - Seed for the generator and the table rolls, so the same dungeon can be made again
+  --table ID - Attach table ID to generated rooms and roll their description from it. Can be given several times.
+  --contents P - Chance that a generated room gets the tables and a description, default 1
+  --check - Afterwards count the rooms that can't be reached from the start room, in the compact form of compact.py
+  --help - Print this help text
+"""
+
+ALGORITHMS = ["walk", "maze", "caves"]
+
+# directions of rooms dug on one level, caves also go diagonally
+CARDINAL = ["n", "e", "s", "w"]
+COMPASS = ["n", "ne", "e", "se", "s", "sw", "w", "nw"]
+
+ADJECTIVES = "Dusty Damp Narrow Wide Collapsed Flooded Silent Cold Dark Crumbling Ancient Hidden Mossy Smoky Echoing".split()
+HALLS = "Hall Corridor Chamber Room Vault Gallery Passage Crypt Cellar Shrine".split()
+CAVES = "Cave Grotto Tunnel Cavern Hollow Fissure Pool Den".split()
+
+# consecutive steps without digging before a walk jumps back to a room dug lately, and how many of those rooms it chooses from
+STUCK = 8
+RECENT = 64
+
+def _add(pos, direction):
+    (dx, dy, dz) = OFFSETS[direction]
+    return (pos[0] + dx, pos[1] + dy, pos[2] + dz)
+
+class Generator(object):
+    """Digs rooms into a state. positions maps grid positions (x, y, level) to room ids and starts with the rooms connected to the
+    room start, laid out as the map command shows them, so new rooms only go to free positions. Call state.beginBulk() before
+    generating and state.endBulk() afterwards."""
+    def __init__(self, state, rng, start, loops=0.1):
+        self.state = state
+        self.rng = rng
+        self.loops = loops
+        self.start = start
+        # the paths of new rooms agree with their positions, so the layout places them there by itself when it gets to them
+        layout = state.layout()
+        layout.placeAll(start)
+        self.where = dict(layout.positions)
+        self.positions = {pos : r for (r, pos) in self.where.items()}
+        # ids of the generated rooms in the order they were made
+        self.rooms = []
+        self.paths = 0
+
+    def _room(self, pos, names):
+        r = self.state.create(self.rng.choice(ADJECTIVES) + " " + self.rng.choice(names))["id"]
+        self.positions[pos] = r
+        self.where[r] = pos
+        self.rooms.append(r)
+        return r
+
+    def _linked(self, r1, r2, direction):
+        return direction in self.state.data["edges"][r1].get(r2, [])
+
+    def link(self, r1, r2, direction):
+        """Connects r1 to r2 going direction and back again."""
+        self.state._connect(r1, r2, direction)
+        self.state._connect(r2, r1, opposite(direction))
+        self.paths += 2
+
+    def walk(self, n, pos, directions=CARDINAL, names=HALLS):
+        """Digs n rooms from the room at pos. The digger keeps going straight most of the time, so there are corridors, and walks through
+        rooms it dug before, sometimes breaking through to them. Returns the rooms dug."""
+        (r, p) = (self.positions[pos], pos)
+        first = len(self.rooms)
+        # rooms that may still have a free position next to them, the ones dug last at the end
+        edge = [r]
+        d = self.rng.choice(directions)
+        stuck = 0
+        while len(self.rooms) - first < n:
+            if stuck > STUCK:
+                # lost in the middle of what was dug, go back to its edge
+                (r, d) = self._edgeRoom(edge, directions, r)
+                p = self.where[r]
+                stuck = 0
+            elif self.rng.random() < 0.3:
+                d = self.rng.choice(directions)
+            p2 = _add(p, d)
+            r2 = self.positions.get(p2)
+            if r2 is None:
+                r2 = self._room(p2, names)
+                self.link(r, r2, d)
+                edge.append(r2)
+                stuck = 0
+            elif self._linked(r, r2, d) or (self.rng.random() < self.loops):
+                if not(self._linked(r, r2, d)):
+                    self.link(r, r2, d)
+                stuck += 1
+            else:
+                # a wall, try another way
+                d = self.rng.choice(directions)
+                stuck += 1
+                continue
+            (r, p) = (r2, p2)
+        return self.rooms[first:]
+
+    def _edgeRoom(self, edge, directions, r):
+        # a room dug lately with a free position next to it and the direction of that position. Rooms without one are dropped from edge
+        while edge:
+            i = self.rng.randrange(max(0, len(edge) - RECENT), len(edge))
+            p = self.where[edge[i]]
+            free = [d for d in directions if not(_add(p, d) in self.positions)]
+            if free:
+                return (edge[i], self.rng.choice(free))
+            edge[i] = edge[-1]
+            edge.pop()
+        # walled in by older rooms, go to the room nearest to r with a free position next to it
+        seen = {self.where[r]}
+        queue = deque([self.where[r]])
+        while True:
+            p = queue.popleft()
+            free = [d for d in directions if not(_add(p, d) in self.positions)]
+            if free:
+                return (self.positions[p], self.rng.choice(free))
+            for d in directions:
+                if not(_add(p, d) in seen):
+                    seen.add(_add(p, d))
+                    queue.append(_add(p, d))
+
+    def maze(self, n, levels=1):
+        """Digs n rooms on a square grid with levels, joined by a random spanning tree with long passages, so there is exactly one way
+        between any two rooms until loops adds some. Positions taken by older rooms are left out of the grid. Returns the rooms dug."""
+        if n < 1:
+            return []
+        perLevel = -(-n // levels)
+        width = max(1, isqrt(perLevel - 1) + 1)
+        # the grid starts south of the start room and goes up from its level
+        (x0, y0, z0) = self.where[self.start]
+        cells = []
+        for z in range(levels):
+            (k, count) = (0, len(cells) + min(perLevel, n - len(cells)))
+            while len(cells) < count:
+                p = (x0 + k % width, y0 + 1 + k // width, z0 + z)
+                if not(p in self.positions):
+                    cells.append(p)
+                k += 1
+        first = len(self.rooms)
+        for p in cells:
+            self._room(p, HALLS)
+        directions = CARDINAL
+        if levels > 1:
+            directions = CARDINAL + ["up", "down"]
+        inMaze = set(cells)
+        visited = set()
+        for p0 in cells:
+            if p0 in visited:
+                continue
+            # the first room, and every part of the grid cut off from it by older rooms, is joined to an older room next to it.
+            # That's the start room for the first one unless the position south of it was taken
+            old = [(d, q) for (d, q) in [(d, _add(p0, d)) for d in directions] if (q in self.positions) and not(q in inMaze)]
+            if old:
+                (d, q) = old[0]
+                self.link(self.positions[q], self.positions[p0], opposite(d))
+            else:
+                self.link(self.start, self.positions[p0], "down")
+            # depth first search with a stack, a recursive one would be too deep for big mazes
+            visited.add(p0)
+            stack = [p0]
+            while stack:
+                p = stack[-1]
+                free = [(d, p2) for (d, p2) in [(d, _add(p, d)) for d in directions] if (p2 in inMaze) and not(p2 in visited)]
+                if not(free):
+                    stack.pop()
+                    continue
+                (d, p2) = self.rng.choice(free)
+                self.link(self.positions[p], self.positions[p2], d)
+                visited.add(p2)
+                stack.append(p2)
+        self._breakThrough(cells, CARDINAL)
+        return self.rooms[first:]
+
+    def _breakThrough(self, cells, directions):
+        # joins neighbouring rooms of cells that aren't connected yet, each with the chance loops
+        for p in cells:
+            if self.rng.random() >= self.loops:
+                continue
+            d = self.rng.choice(directions)
+            r2 = self.positions.get(_add(p, d))
+            if (r2 is not None) and not(self._linked(self.positions[p], r2, d)):
+                self.link(self.positions[p], r2, d)
+        return
+
+    def caves(self, n, levels=3):
+        """Digs n rooms on several levels of caves. Every level is dug from a path down from a random cave of the level above, and
+        more paths up and down join caves lying above each other. Returns the rooms dug."""
+        first = len(self.rooms)
+        levels = max(1, min(levels, n))
+        perLevel = [n // levels + (1 if z < n % levels else 0) for z in range(levels)]
+        dug = [self.walk(perLevel[0], self.where[self.start], COMPASS, CAVES)]
+        for z in range(1, levels):
+            above = dug[-1] or [self.start]
+            # a cave with no older room below it
+            below = [r for r in above if not(_add(self.where[r], "down") in self.positions)]
+            if not(below):
+                dug.append(self.walk(perLevel[z], self.where[self.rng.choice(above)], COMPASS, CAVES))
+                continue
+            r = self.rng.choice(below)
+            p = _add(self.where[r], "down")
+            r2 = self._room(p, CAVES)
+            self.link(r, r2, "down")
+            dug.append([r2] + self.walk(perLevel[z] - 1, p, COMPASS, CAVES))
+        # a few more ways between the levels where caves lie above each other
+        for p in [self.where[r] for r in self.rooms[first:]]:
+            below = self.positions.get(_add(p, "down"))
+            if (below is not None) and (self.rng.random() < self.loops / 10) and not(self._linked(self.positions[p], below, "down")):
+                self.link(self.positions[p], below, "down")
+        return self.rooms[first:]
+
+    def fill(self, tableIds, chance=1):
+        """Attaches the tables tableIds to the generated rooms with the given chance and rolls their descriptions from them."""
+        for r in self.rooms:
+            if self.rng.random() >= chance:
+                continue
+            for t in tableIds:
+                self.state._tableMapToRoom(t, r)
+            rolls = [self.state._tableRoll(t) for t in tableIds]
+            self.state._setDescription(r, "\n".join([w for w in rolls if w]))
+        return
+
+def generate(state, algorithm, n, rng, levels=None, loops=0.1, tableIds=[], contents=1):
+    """Adds n rooms made by algorithm to state, starting from its current room. Returns the Generator, which lists the rooms made."""
+    g = Generator(state, rng.split("rooms"), state.data["current_room"], loops)
+    # millions of new dicts without cycles, see loadData in dungeme.py
+    collecting = gc.isenabled()
+    gc.disable()
+    state.beginBulk()
+    try:
+        if algorithm == "maze":
+            g.maze(n, levels or 1)
+        elif algorithm == "caves":
+            g.caves(n, levels or 3)
+        else:
+            g.walk(n, g.where[g.start])
+        if tableIds:
+            state.rng = rng.split("tables")
+            g.rng = rng.split("contents")
+            g.fill(tableIds, contents)
+    finally:
+        state.endBulk()
+        if collecting:
+            gc.enable()
+    return g
+
+def unreachable(state, start):
+    """Ids of the rooms of state that can't be reached from room start. Walks the compact form of the dungeon, which holds even a
+    million rooms in little memory and follows paths without hashing string ids."""
+    c = CompactDungeon.fromData(state.data)
+    dist = c.distances(int(start))
+    return [str(r.id) for r in c.rooms if (r is not None) and (dist[r.id] < 0)]
+
+def main(argv):
+    if (len(argv) < 2) or ("--help" in argv):
+        print(HELPTEXT)
+        return
+
+    opts = {"--algorithm": "walk", "--rooms": "1000", "--levels": "", "--loops": "0.1", "--seed": "", "--contents": "1"}
+    tableIds = []
+    for (i, w) in enumerate(argv):
+        if i + 1 >= len(argv):
+            continue
+        if w in opts:
+            opts[w] = argv[i + 1]
+        elif w == "--table":
+            if not(argv[i + 1].isnumeric()):
+                print("Table ids are numbers, see the tgl command of dungeme.py.")
+                return
+            tableIds.append(int(argv[i + 1]))
+
+    if not(opts["--algorithm"] in ALGORITHMS):
+        print("Unknown algorithm '" + opts["--algorithm"] + "', try one of " + ", ".join(ALGORITHMS) + ".")
+        return
+    if not(opts["--rooms"].isnumeric()) or (opts["--levels"] and not(opts["--levels"].isnumeric())):
+        print("Please specify the number of rooms and levels as numbers.")
+        return
+    try:
+        loops = float(opts["--loops"])
+        contents = float(opts["--contents"])
+    except ValueError:
+        print("Please specify --loops and --contents as numbers between 0 and 1.")
+        return
+    if opts["--seed"]:
+        rng = Stream(int(opts["--seed"]))
+    else:
+        rng = Stream()
+
+    file = argv[1]
+    if not(os.path.isfile(file)):
+        createDungeonfile(file)
+    state = State.fromFile(file)
+    for t in tableIds:
+        if not(t in state.tables):
+            print("Error: Table with id " + str(t) + " not found.")
+            return
+    if ("--check" in argv) and state._store:
+        print("--check needs the whole dungeon in memory and does not work with databases.")
+        return
+
+    start = time.perf_counter()
+    g = generate(state, opts["--algorithm"], int(opts["--rooms"]), rng, int(opts["--levels"] or 0), loops, tableIds, contents)
+    generated = time.perf_counter() - start
+    state.snapshot()
+    saved = time.perf_counter() - start - generated
+    print("Ok. Generated " + str(len(g.rooms)) + " room(s) and " + str(g.paths) + " path(s) in " + str(round(generated, 2)) + " seconds, saved in " + str(round(saved, 2)) + " seconds. The dungeon has " + str(numRooms(state)) + " room(s).")
+    if "--check" in argv:
+        lost = unreachable(state, g.start)
+        print(str(len(lost)) + " room(s) of the dungeon can't be reached from room " + g.start + ".")
+
+if (__name__ == "__main__"):
+    main(sys.argv)
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+#
+# hoard.py
+#
+# Gem hoard generator built on the gem tables in rules/gems.org.
+# Rolls how many gems of every value tier a hoard holds and which gems they are, and simulates many hoards at once
+# to tune the treasure economy. Gold converts to experience 1:1, see rules/rules.org.
+
+import os.path
+import sys
+from collections import Counter
+from math import gcd
+from dice import parseDice
+from tableimport import readTables, parseGp
+from rng import Stream
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HELPTEXT = """hoard.py - Gem hoard generator
+Usage: hoard.py [OPTIONS]
+
+Without options, rolls a single hoard and lists the gems in it.
+
+Options
+  --gems FILE - Org-mode file with the gem tables, default rules/gems.org
+  --tier VALUE=DICE - Number of gems of the tier worth VALUE gp in a hoard, e.g. --tier 500=1d4-1. Can be given several times, replaces the default profile
+  --simulate N - Roll N hoards and report the expected value and percentiles instead
+  --players N - Also report the experience every player gets from a hoard, split evenly
+  --seed SEED - Seed for all rolls
+  --help - Print this help text
+"""
+
+DEFAULTGEMFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rules", "gems.org")
+
+# default number of gems per tier in a hoard. Negative rolls mean no gems of that tier
+DEFAULTPROFILE = [(10, "3d6"), (50, "2d6"), (100, "1d6"), (500, "1d4-2"), (1000, "1d6-4"), (5000, "1d10-9")]
+
+PERCENTILES = [5, 25, 50, 75, 95, 99]
+
+def loadGemTiers(filename=DEFAULTGEMFILE):
+    """Reads the gem tables and returns a dict of gp values to lists of gem names. Every table tableimport reads from the file is a tier,
+    with the value its name starts with, like '1,000 gp gems'."""
+    tiers = {}
+    for t in readTables(filename):
+        value = parseGp(" ".join(t.name().split()[:2]))
+        if value is None:
+            continue
+        # a gem listed twice is twice as likely, so every range entry counts with the number of rolls it covers,
+        # divided by what all of them share, so a plain list has every gem once
+        dist = t.distribution()
+        entries = [(w, dist.rangeCount(a, b)) for (a, b, w) in t.toDict()["entries"] if w]
+        unit = gcd(*[n for (w, n) in entries]) or 1
+        for (w, n) in entries:
+            tiers.setdefault(value, []).extend([w] * (n // unit))
+    return tiers
+
+class Hoard(object):
+    """Gem hoards of a profile, a list of (gp value, dice expression) tuples for the number of gems per tier."""
+    def __init__(self, tiers, profile=DEFAULTPROFILE):
+        self.tiers = tiers
+        # tiers without any gems in the gem file are dropped
+        self.profile = [(value, parseDice(w)) for (value, w) in profile if tiers.get(value)]
+
+    def roll(self, rng=None):
+        """Rolls one hoard. Returns a dict of gp values to Counters of gem names, and the total value."""
+        rng = rng or Stream()
+        gems = {}
+        total = 0
+        for (value, e) in self.profile:
+            n = max(0, e.roll(rng))
+            if n:
+                gems[value] = Counter(rng.choices(self.tiers[value], k=n))
+                total += n * value
+        return (gems, total)
+
+    def expectedValue(self):
+        """Exact expected gp value of a hoard, from the dice distributions."""
+        acc = 0
+        for (value, e) in self.profile:
+            d = e.distribution()
+            # negative rolls count as zero gems
+            acc += value * sum([max(0, d.lower + i) * c for (i, c) in enumerate(d.counts)]) / d.total
+        return acc
+
+    def simulate(self, n, rng=None):
+        """Rolls n hoards at once and returns a list of their total values, sorted."""
+        rng = rng or Stream()
+        if numpy:
+            totals = numpy.zeros(n, dtype=numpy.int64)
+            for (value, e) in self.profile:
+                totals += value * numpy.maximum(0, numpy.array(e.rollMany(n, rng.split(value)), dtype=numpy.int64))
+            return sorted(totals.tolist())
+        totals = [0] * n
+        for (value, e) in self.profile:
+            counts = e.rollMany(n, rng.split(value))
+            totals = [t + value * max(0, c) for (t, c) in zip(totals, counts)]
+        return sorted(totals)
+
+def percentile(xs, p):
+    """p-th percentile of the sorted list xs, nearest rank."""
+    i = max(0, min(len(xs) - 1, int(round(p / 100 * len(xs))) - 1))
+    return xs[i]
+
+def showHoard(gems, total, players=0):
+    w = ""
+    for value in sorted(gems):
+        w += "* " + str(sum(gems[value].values())) + " gems of " + str(value) + " gp\n"
+        for (name, count) in sorted(gems[value].items()):
+            w += str(count) + " " + name + "\n"
+    w += "Total: " + str(total) + " gp\n"
+    if players:
+        w += "Experience per player: " + str(total // players) + "\n"
+    return w
+
+def showSimulation(h, totals, players=0):
+    w = "Hoards: " + str(len(totals)) + "\n"
+    w += "Expected value: " + str(round(h.expectedValue(), 2)) + " gp (simulated mean " + str(round(sum(totals) / len(totals), 2)) + " gp)\n"
+    for p in PERCENTILES:
+        w += str(p) + "th percentile: " + str(percentile(totals, p)) + " gp\n"
+    if players:
+        w += "Expected experience per player: " + str(round(h.expectedValue() / players, 2)) + "\n"
+    return w
+
+def main(argv):
+    if "--help" in argv:
+        print(HELPTEXT)
+        return
+
+    opts = {"--gems": DEFAULTGEMFILE, "--simulate": "0", "--players": "0", "--seed": ""}
+    profile = []
+    for (i, w) in enumerate(argv):
+        if i + 1 >= len(argv):
+            continue
+        if w in opts:
+            opts[w] = argv[i + 1]
+        elif w == "--tier":
+            ws = argv[i + 1].split("=")
+            if (len(ws) != 2) or not(ws[0].isnumeric()):
+                print("Could not parse tier '" + argv[i + 1] + "', try --tier 500=1d4-1.")
+                return
+            profile.append((int(ws[0]), ws[1]))
+
+    if opts["--seed"]:
+        rng = Stream(int(opts["--seed"]))
+    else:
+        rng = Stream()
+    h = Hoard(loadGemTiers(opts["--gems"]), profile or DEFAULTPROFILE)
+    players = int(opts["--players"])
+    n = int(opts["--simulate"])
+    if n > 0:
+        print(showSimulation(h, h.simulate(n, rng), players))
+    else:
+        (gems, total) = h.roll(rng)
+        print(showHoard(gems, total, players))
+
+if (__name__ == "__main__"):
+    main(sys.argv)
@@ -0,0 +1,194 @@
+#!/bin/python3
+#
+# layout.py
+#
+# Grid coordinates for rooms, derived from the directions of the paths between them, and ASCII maps drawn from them.
+# Rooms are placed once and keep their position, new rooms are placed next to a neighbour that already has one.
+# Only the rooms around the room a map is drawn for are laid out, the rest when a map gets to them.
+
+# grid offset (x, y, z) of every direction, y grows to the south
+OFFSETS = {"n" : (0, -1, 0), "ne" : (1, -1, 0), "e" : (1, 0, 0), "se" : (1, 1, 0), "s" : (0, 1, 0), "sw" : (-1, 1, 0), "w" : (-1, 0, 0), "nw" : (-1, -1, 0), "up" : (0, 0, 1), "down" : (0, 0, -1)}
+
+# connecting line drawn between two rooms next to each other
+LINES = {(1, 0) : "-", (0, 1) : "|", (1, 1) : "\\", (-1, 1) : "/"}
+
+# width and height of the squares of the spatial index
+CHUNKSIZE = 16
+
+MAPLEGEND = "@ you are here, o room, < path up, > path down, * paths up and down"
+
+def _chunk(pos):
+    (x, y, z) = pos
+    return (x // CHUNKSIZE, y // CHUNKSIZE, z)
+
+def _add(pos, offset, sign=1):
+    return (pos[0] + sign * offset[0], pos[1] + sign * offset[1], pos[2] + sign * offset[2])
+
+class Layout(object):
+    """Positions of rooms on a grid with levels. neighbours(r) yields (direction, r2) for every room r2 that lies in a direction from room r,
+    whichever way the path between them goes. Rooms are laid out lazily by update(), around the current room and starting from rooms marked with touch()."""
+    def __init__(self, neighbours):
+        self.neighbours = neighbours
+        self.positions = {}
+        # (chunk x, chunk y, z) to a dict of positions to room ids in that square
+        self._chunks = {}
+        self._pending = set()
+
+    def position(self, r):
+        return self.positions.get(r)
+
+    def roomAt(self, pos):
+        return self._chunks.get(_chunk(pos), {}).get(pos)
+
+    def _free(self, pos):
+        # the nearest free position on the same level, searched in growing squares around pos
+        if self.roomAt(pos) is None:
+            return pos
+        (x, y, z) = pos
+        d = 1
+        while True:
+            ring = [(x + i, y - d, z) for i in range(-d, d + 1)] + [(x + i, y + d, z) for i in range(-d, d + 1)]
+            ring += [(x - d, y + i, z) for i in range(-d + 1, d)] + [(x + d, y + i, z) for i in range(-d + 1, d)]
+            for p in sorted(ring, key=lambda p: abs(p[0] - x) + abs(p[1] - y)):
+                if self.roomAt(p) is None:
+                    return p
+            d += 1
+
+    def place(self, r, pos):
+        """Puts room r at pos, or at the nearest free position on that level if another room is there. Returns the position used."""
+        self.remove(r)
+        pos = self._free(pos)
+        self.positions[r] = pos
+        self._chunks.setdefault(_chunk(pos), {})[pos] = r
+        return pos
+
+    def remove(self, r):
+        pos = self.positions.pop(r, None)
+        if pos is not None:
+            del self._chunks[_chunk(pos)][pos]
+        self._pending.discard(r)
+
+    def touch(self, r):
+        """Marks room r as new or newly connected, so the next update places it if it has no position yet."""
+        if not(r in self.positions):
+            self._pending.add(r)
+
+    def _extend(self, start, radius):
+        # places the rooms without a position next to the rooms that can be reached from start, which has one, breadth first.
+        # Only goes on through rooms at most radius squares or levels away from start, or through all of them for a radius of None
+        center = self.positions[start]
+        seen = {start}
+        frontier = [start]
+        while frontier:
+            nextFrontier = []
+            for r in frontier:
+                for (d, r2) in self.neighbours(r):
+                    if (r2 in seen) or not(d in OFFSETS):
+                        continue
+                    if not(r2 in self.positions):
+                        self.place(r2, _add(self.positions[r], OFFSETS[d]))
+                        self._pending.discard(r2)
+                    seen.add(r2)
+                    p = self.positions[r2]
+                    if (radius is None) or max(abs(p[0] - center[0]), abs(p[1] - center[1]), abs(p[2] - center[2])) <= radius:
+                        nextFrontier.append(r2)
+            frontier = nextFrontier
+
+    def placeAll(self, start):
+        """Places room start and every room connected to it, also through rooms placed before, e.g. to add rooms around them."""
+        self.update(start)
+        self._extend(start, None)
+        return
+
+    def update(self, current, radius=0):
+        """Places the touched rooms next to a neighbour with a position, the room current if it still has none, and the rooms
+        connected to current through rooms at most radius squares away from it. So a map only lays out what it shows."""
+        pending = self._pending
+        self._pending = set()
+        for r in pending:
+            if r in self.positions:
+                continue
+            for (d, r2) in self.neighbours(r):
+                if (r2 in self.positions) and (d in OFFSETS):
+                    self.place(r, _add(self.positions[r2], OFFSETS[d], -1))
+                    break
+        if not(current in self.positions):
+            self._placeNear(current)
+        self._extend(current, radius)
+        return
+
+    def _placeNear(self, r):
+        # places room r next to the nearest room with a position that it is connected to, and the rooms on the way between them,
+        # so it agrees with the rooms placed before. At the origin if it isn't connected to any
+        via = {r : None}
+        # nothing to agree with yet, e.g. for the first map
+        frontier = [r] if self.positions else []
+        while frontier:
+            nextFrontier = []
+            for u in frontier:
+                for (d, u2) in self.neighbours(u):
+                    if not(d in OFFSETS) or (u2 in via):
+                        continue
+                    if u2 in self.positions:
+                        # back along the way to r
+                        pos = _add(self.positions[u2], OFFSETS[d], -1)
+                        while u is not None:
+                            pos = self.place(u, pos)
+                            if via[u] is None:
+                                return
+                            (u, d) = via[u]
+                            pos = _add(pos, OFFSETS[d], -1)
+                    via[u2] = (u, d)
+                    nextFrontier.append(u2)
+            frontier = nextFrontier
+        # a room not connected to anything placed so far
+        self.place(r, (0, 0, 0))
+
+    def window(self, center, radius):
+        """Dict of (x, y) to room id for the rooms on the level of center at most radius squares away from it."""
+        (x, y, z) = center
+        acc = {}
+        for cx in range((x - radius) // CHUNKSIZE, (x + radius) // CHUNKSIZE + 1):
+            for cy in range((y - radius) // CHUNKSIZE, (y + radius) // CHUNKSIZE + 1):
+                for (pos, r) in self._chunks.get((cx, cy, z), {}).items():
+                    if (abs(pos[0] - x) <= radius) and (abs(pos[1] - y) <= radius):
+                        acc[(pos[0], pos[1])] = r
+        return acc
+
+def renderMap(layout, current, radius, exits):
+    """ASCII map of the rooms around room current. exits(r) returns the dict of directions to rooms for the paths going out from r.
+    Rooms are drawn every second character, with lines between rooms connected by a path that are next to each other."""
+    center = layout.position(current)
+    (cx, cy, z) = center
+    rooms = layout.window(center, radius)
+    size = 4 * radius + 1
+    grid = [[" "] * size for i in range(size)]
+    for ((x, y), r) in rooms.items():
+        (gx, gy) = (2 * (x - cx + radius), 2 * (y - cy + radius))
+        ds = exits(r)
+        if r == current:
+            c = "@"
+        elif ("up" in ds) and ("down" in ds):
+            c = "*"
+        elif "up" in ds:
+            c = "<"
+        elif "down" in ds:
+            c = ">"
+        else:
+            c = "o"
+        grid[gy][gx] = c
+        for (d, r2) in ds.items():
+            if not(d in OFFSETS) or (layout.position(r2) != _add((x, y, z), OFFSETS[d])):
+                continue
+            (dx, dy, dz) = OFFSETS[d]
+            if dz:
+                continue
+            # lines are keyed by the direction going east or south
+            line = LINES.get((dx, dy)) or LINES.get((-dx, -dy))
+            (lx, ly) = (gx + dx, gy + dy)
+            if (0 <= lx < size) and (0 <= ly < size):
+                grid[ly][lx] = line
+    w = "Level " + str(z) + "\n"
+    w += "\n".join(["".join(row).rstrip() for row in grid]) + "\n"
+    w += "Legend: " + MAPLEGEND
+    return w
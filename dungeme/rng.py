@@ -0,0 +1,29 @@
+#!/bin/python3
+#
+# rng.py
+#
+# Seeded random streams that can be split into independent child streams
+
+import random
+from hashlib import sha256
+
+class Stream(random.Random):
+    """A random number generator with all the methods of random.Random, seeded from a root seed and a path of keys.
+    stream.split(key) gives a child stream that only depends on the root seed and the keys, not on how much the parent was used.
+    So giving every table, room or worker its own child stream makes results reproducible no matter in which order or process they run."""
+    def __init__(self, seed=None, path=()):
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**64)
+        self.rootSeed = seed
+        self.path = tuple(path)
+        # hash() is salted per process, so derive the actual seed with sha256
+        digest = sha256(repr((self.rootSeed, self.path)).encode("utf-8")).digest()
+        super().__init__(int.from_bytes(digest, "big"))
+
+    def split(self, key):
+        """Returns the child stream for key, e.g. a table id, a room id or the number of a job."""
+        return Stream(self.rootSeed, self.path + (key,))
+
+    def __reduce__(self):
+        # so streams can be sent to worker processes with their current state
+        return (Stream, (self.rootSeed, self.path), self.getstate())
@@ -0,0 +1,65 @@
+#!/bin/python3
+#
+# search.py
+#
+# Inverted index over the words in rooms, for finding rooms by their names, descriptions, notes and skill checks
+
+import re
+import heapq
+from math import log
+from collections import Counter
+
+WORD = re.compile(r"[a-z0-9]+")
+
+def words(w):
+    """Lower case words in the string w."""
+    return WORD.findall(w.lower())
+
+class SearchIndex(object):
+    """Maps every word to the rooms it appears in and how often. Rooms are updated one text at a time with add, or all at once with setRoom."""
+    def __init__(self):
+        # word to dict of room id to count
+        self._postings = {}
+        # room id to Counter of its words, so a room can be dropped without its texts
+        self._rooms = {}
+
+    def add(self, r, text):
+        """Adds the words of text to room r."""
+        c = Counter(words(text))
+        self._rooms.setdefault(r, Counter()).update(c)
+        for (w, n) in c.items():
+            p = self._postings.setdefault(w, {})
+            p[r] = p.get(r, 0) + n
+
+    def drop(self, r):
+        """Removes room r from the index."""
+        for w in self._rooms.pop(r, {}):
+            p = self._postings[w]
+            del p[r]
+            if not(p):
+                del self._postings[w]
+
+    def setRoom(self, r, texts):
+        """Replaces everything indexed for room r with the words of texts."""
+        self.drop(r)
+        for text in texts:
+            self.add(r, text)
+
+    def find(self, query, limit=10):
+        """Returns up to limit (score, room id) tuples for the rooms matching the words in query, best first.
+        Rooms containing all words are preferred, if there are none rooms with any of the words are returned.
+        Words that are rare in the dungeon count more, see tf-idf."""
+        ws = list(set(words(query)))
+        postings = [self._postings.get(w, {}) for w in ws]
+        if not(ws) or not(any(postings)):
+            return []
+        # rooms containing all the words, starting from the rarest word
+        rarest = min(postings, key=len)
+        candidates = [r for r in rarest if all([r in p for p in postings])]
+        if not(candidates):
+            candidates = set().union(*postings)
+
+        n = len(self._rooms)
+        idf = [log(1 + n / len(p)) if p else 0 for p in postings]
+        scored = [(sum([p.get(r, 0) * f for (p, f) in zip(postings, idf)]), r) for r in candidates]
+        return heapq.nlargest(limit, scored)
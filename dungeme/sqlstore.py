@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+#
+# sqlstore.py
+#
+# SQLite storage for dungeons. Rooms, paths, table mappings and tables are read from the database when they are first used,
+# so opening a big dungeon only costs what is actually looked at. Changes are written as one transaction per save.
+#
+# Run as a script to convert between the JSON dungeon files and SQLite databases.
+
+import sys
+import json
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+HELPTEXT = """sqlstore.py - Convert dungeon files between JSON and SQLite
+Usage: sqlstore.py SOURCE TARGET
+
+If SOURCE is a JSON dungeon file, TARGET is created as a SQLite database holding the same dungeon.
+If SOURCE is a database (ending in .db or .sqlite), TARGET is written as a JSON dungeon file.
+dungeme.py opens a database directly if the dungeon file ends in .db or .sqlite.
+"""
+
+SCHEMA = """
+create table if not exists meta (key text primary key, value text);
+create table if not exists rooms (id text primary key, name text, data text);
+create table if not exists notes (room text, n integer, text text, primary key (room, n));
+create table if not exists skill_checks (room text, n integer, data text, primary key (room, n));
+create table if not exists edge_lists (source text primary key);
+create table if not exists edges (source text, target text, n integer, paths text, primary key (source, target));
+create index if not exists edges_target on edges (target);
+create table if not exists table_map (room text primary key, tables text);
+create table if not exists tables (id integer primary key, name text, data text);
+"""
+
+# the sections of a dungeon that are kept in their own tables, everything else in data is a row of meta
+SECTIONS = ["rooms", "edges", "table_map"]
+
+# number of keys asked for in one query, SQLite allows only so many parameters
+BATCHSIZE = 500
+
+# table and key column listing the keys of every section
+KEYS = {"rooms" : ("rooms", "id"), "edges" : ("edge_lists", "source"), "table_map" : ("table_map", "room"), "tables" : ("tables", "id")}
+
+def isDatabase(filename):
+    return filename.endswith(".db") or filename.endswith(".sqlite")
+
+class SqlStore(object):
+    """A dungeon in a SQLite database. Reads happen on the calling thread, writes usually on the autosave thread, so the connection is shared behind a lock."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # number of writes so far, so callers know when what they learned about the database may be out of date
+        self.writes = 0
+
+    def close(self):
+        self._db.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def meta(self):
+        """The top level values of the dungeon, like current_room and next_id."""
+        return {k : json.loads(v) for (k, v) in self._query("select key, value from meta")}
+
+    def keys(self, section):
+        (table, column) = KEYS[section]
+        return [k for (k,) in self._query("select " + column + " from " + table)]
+
+    def has(self, section, k):
+        (table, column) = KEYS[section]
+        return bool(self._query("select 1 from " + table + " where " + column + " = ?", (k,)))
+
+    def present(self, section, keys):
+        """The set of keys in keys that a section has in the database, asked in batches instead of one query per key."""
+        (table, column) = KEYS[section]
+        keys = list(keys)
+        acc = set()
+        for i in range(0, len(keys), BATCHSIZE):
+            batch = keys[i:i + BATCHSIZE]
+            acc.update([k for (k,) in self._query("select " + column + " from " + table + " where " + column + " in (" + ", ".join(["?"] * len(batch)) + ")", batch)])
+        return acc
+
+    def count(self, section):
+        (table, column) = KEYS[section]
+        return self._query("select count(*) from " + table)[0][0]
+
+    def read(self, section, k):
+        """The value of key k in a section as it would be in the JSON dungeon file, None if there is none."""
+        if section == "rooms":
+            rows = self._query("select data from rooms where id = ?", (k,))
+            if not(rows):
+                return None
+            room = json.loads(rows[0][0])
+            # notes and skill checks have their own rows, the room only keeps their place
+            if "notes" in room:
+                room["notes"] = [w for (w,) in self._query("select text from notes where room = ? order by n", (k,))]
+            if "skill_checks" in room:
+                room["skill_checks"] = [json.loads(w) for (w,) in self._query("select data from skill_checks where room = ? order by n", (k,))]
+            return room
+        if section == "edges":
+            if not(self.has("edges", k)):
+                return None
+            return {target : json.loads(paths) for (target, paths) in self._query("select target, paths from edges where source = ? order by n", (k,))}
+        if section == "table_map":
+            rows = self._query("select tables from table_map where room = ?", (k,))
+        else:
+            rows = self._query("select data from tables where id = ?", (k,))
+        if not(rows):
+            return None
+        return json.loads(rows[0][0])
+
+    def sources(self, target):
+        """Ids of the rooms with paths to target, straight from the database."""
+        return [k for (k,) in self._query("select source from edges where target = ?", (target,))]
+
+    def rows(self, kind, k, value):
+        """The statements that store value under key k, a list of (sql, parameters) tuples. kind is "data" for a top level value or a section.
+        A value of None deletes the key. Values are encoded right away, so they can be written later while the dungeon keeps changing."""
+        if kind == "data":
+            if value is None:
+                return [("delete from meta where key = ?", (k,))]
+            return [("insert or replace into meta values (?, ?)", (k, json.dumps(value)))]
+        if kind == "rooms":
+            acc = [("delete from rooms where id = ?", (k,)), ("delete from notes where room = ?", (k,)), ("delete from skill_checks where room = ?", (k,))]
+            if value is None:
+                return acc
+            room = dict(value)
+            if "notes" in room:
+                acc += [("insert into notes values (?, ?, ?)", (k, n, w)) for (n, w) in enumerate(room["notes"])]
+                room["notes"] = None
+            if "skill_checks" in room:
+                acc += [("insert into skill_checks values (?, ?, ?)", (k, n, json.dumps(s))) for (n, s) in enumerate(room["skill_checks"])]
+                room["skill_checks"] = None
+            acc.append(("insert into rooms values (?, ?, ?)", (k, value.get("name", ""), json.dumps(room))))
+            return acc
+        if kind == "edges":
+            acc = [("delete from edge_lists where source = ?", (k,)), ("delete from edges where source = ?", (k,))]
+            if value is None:
+                return acc
+            acc.append(("insert into edge_lists values (?)", (k,)))
+            acc += [("insert into edges values (?, ?, ?, ?)", (k, target, n, json.dumps(paths))) for (n, (target, paths)) in enumerate(value.items())]
+            return acc
+        if kind == "table_map":
+            if value is None:
+                return [("delete from table_map where room = ?", (k,))]
+            return [("insert or replace into table_map values (?, ?)", (k, json.dumps(value)))]
+        if value is None:
+            return [("delete from tables where id = ?", (k,))]
+        return [("insert or replace into tables values (?, ?, ?)", (k, value.get("name", ""), json.dumps(value)))]
+
+    def write(self, statements):
+        """Runs lists of statements made by rows in one transaction."""
+        with self._lock:
+            with self._db:
+                for rows in statements:
+                    for (sql, params) in rows:
+                        self._db.execute(sql, params)
+            self.writes += 1
+        return
+
+class SqlMapping(MutableMapping):
+    """Dictionary of one section of a dungeon in a SqlStore. Values are read from the database when first used and then kept, changed values only
+    live here until they are saved with SqlStore.write. So the mapping always shows the dungeon as it is in memory."""
+    def __init__(self, store, section):
+        self.store = store
+        self.section = section
+        self._cache = {}
+        self._deleted = set()
+        # which keys of _cache and _deleted the database has, valid until the store is written to again
+        self._inStore = {}
+        self._inStoreWrites = None
+
+    def __getitem__(self, k):
+        if k in self._cache:
+            return self._cache[k]
+        if k in self._deleted:
+            raise KeyError(k)
+        value = self.store.read(self.section, k)
+        if value is None:
+            raise KeyError(k)
+        self._cache[k] = value
+        return value
+
+    def __setitem__(self, k, value):
+        self._cache[k] = value
+        self._deleted.discard(k)
+
+    def __delitem__(self, k):
+        if not(k in self):
+            raise KeyError(k)
+        self._cache.pop(k, None)
+        self._deleted.add(k)
+
+    def __contains__(self, k):
+        if k in self._cache:
+            return True
+        if k in self._deleted:
+            return False
+        return self.store.has(self.section, k)
+
+    def __iter__(self):
+        for k in list(self._cache):
+            yield k
+        for k in self.store.keys(self.section):
+            if not(k in self._cache) and not(k in self._deleted):
+                yield k
+
+    def __len__(self):
+        if self._inStoreWrites != self.store.writes:
+            self._inStore = {}
+            self._inStoreWrites = self.store.writes
+        unknown = [k for k in list(self._cache) + list(self._deleted) if not(k in self._inStore)]
+        present = self.store.present(self.section, unknown)
+        self._inStore.update({k : (k in present) for k in unknown})
+        n = self.store.count(self.section)
+        n += len([k for k in self._cache if not(self._inStore[k])])
+        n -= len([k for k in self._deleted if self._inStore[k]])
+        return n
+
+def openDungeon(filename):
+    """Returns the data and tables of a dungeon in a database, like the JSON file has them, with lazy mappings instead of dicts."""
+    store = SqlStore(filename)
+    data = store.meta()
+    for section in SECTIONS:
+        data[section] = SqlMapping(store, section)
+    return (store, data, SqlMapping(store, "tables"))
+
+def writeDungeon(filename, data, tables):
+    """Creates a database from the data and tables of a JSON dungeon file."""
+    store = SqlStore(filename)
+    statements = []
+    for (k, value) in data.items():
+        if k in SECTIONS:
+            statements += [store.rows(k, key, v) for (key, v) in value.items()]
+        else:
+            statements.append(store.rows("data", k, value))
+    statements += [store.rows("tables", int(k), d) for (k, d) in tables.items()]
+    store.write(statements)
+    store.close()
+
+def readDungeon(filename):
+    """Reads a whole dungeon from a database, as the list of data and tables of a JSON dungeon file."""
+    (store, data, tables) = openDungeon(filename)
+    for section in SECTIONS:
+        data[section] = dict(data[section])
+    s = [data, dict(tables)]
+    store.close()
+    return s
+
+def main(argv):
+    if (len(argv) != 3) or ("--help" in argv):
+        print(HELPTEXT)
+        return
+    (source, target) = (argv[1], argv[2])
+    if isDatabase(source):
+        f = open(target, "w")
+        json.dump(readDungeon(source), f)
+        f.close()
+    else:
+        (data, tables) = json.load(open(source))
+        writeDungeon(target, data, tables)
+
+if (__name__ == "__main__"):
+    main(sys.argv)
@@ -4,34 +4,110 @@
 #
 # Library for random tables
 
-from random import randint
-from copy import deepcopy
+import random
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from collections.abc import MutableMapping
+from fractions import Fraction
+from dice import parseDice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def tableReference(w):
+    """Returns the table id if the entry w is a reference to another table, written as @TABLEID. None otherwise."""
+    if (len(w) > 1) and (w[0] == "@") and w[1:].isnumeric():
+        return int(w[1:])
+    return None
+
+# Version of the table dictionaries written by toDict.
+# Version 1 (no "version" key) has a dict of entries with keys like "(1, 4)".
+# Version 2 has a list of [start, end, entry] lists.
+TABLEVERSION = 2
+
+def parseBounds(w):
+    """Parses an entry key of a version 1 table like "(1, 4)" into a tuple of ints."""
+    ws = w.strip().strip("()").split(",")
+    if len(ws) != 2:
+        raise ValueError("Not a valid table entry key: " + w)
+    return (int(ws[0]), int(ws[1]))
+
+def tableType(d):
+    """Type of an encoded table, e.g. 2d6, without decoding it."""
+    if d.get("kind") == "weighted":
+        return "weighted"
+    if "expression" in d:
+        return d["expression"]
+    return str(d["dice"]) + "d" + str(d["sides"])
 
 class Table(object):
+    # bumped whenever any table changes, so caches spanning several tables know when to recompile
+    generation = 0
+
     def fromDict(d):
-        # the dictionary will have strings instead of tuples for entries' keys
-        entries = d["entries"]
-        entries2 = dict([(eval(k), v) for (k, v) in entries.items()])
+        d = dict(d)
+        version = d.pop("version", 1)
+        if version == 1:
+            # the dictionary will have strings instead of tuples for entries' keys
+            entries = dict([(parseBounds(k), v) for (k, v) in d["entries"].items()])
+        else:
+            entries = dict([((a, b), w) for (a, b, w) in d["entries"]])
 
         t = Table(d["dice"], d["sides"], d["name"])
         t._d = d
-        t._d["entries"] = entries2
+        t._d["entries"] = entries
+        if "deck" in d:
+            t._d["deck"] = dict(d["deck"])
+        t._reindex()
+        # not _changed, that would reshuffle a saved deck
+        t._sampler = None
+        Table.generation += 1
         return t
 
     def toDict(self):
-        d = deepcopy(self._d)
-        d["entries"] = {str(k) : v for k,v in self._d["entries"].items()}
+        d = dict(self._d)
+        d["version"] = TABLEVERSION
+        d["entries"] = [[a, b, self._d["entries"][(a, b)]] for (a, b) in zip(self._starts, self._ends)]
+        if "deck" in d:
+            d["deck"] = dict(d["deck"], cards=list(d["deck"]["cards"]))
         return d
 
-    def __init__(self, dice, sides, name, desc=""):
+    def __init__(self, dice, sides, name, desc="", expression=None):
         self._d = {"dice" : dice, "sides":sides, "name" : name, "description" : "", "entries": {}}
+        # tables rolled with more than a plain NdS, e.g. 3d6+2 or 4d6kh3, keep the whole dice expression
+        if expression:
+            self._d["expression"] = expression
+        # sorted, non-overlapping entry bounds, kept in sync with _d["entries"]
+        self._starts = []
+        self._ends = []
+        # compiled lookup for bulk rolling, dropped whenever an entry changes
+        self._sampler = None
         self.setDescription(desc)
 
+    def _changed(self):
+        self._sampler = None
+        Table.generation += 1
+        if self.isDeck():
+            self.reshuffle()
+
+    def _reindex(self):
+        bounds = sorted(self._d["entries"].keys())
+        self._starts = [a for (a, b) in bounds]
+        self._ends = [b for (a, b) in bounds]
+
     def name(self):
         return self._d["name"]
 
     def type(self):
+        if "expression" in self._d:
+            return self._d["expression"]
         return str(self._d["dice"]) + "d" + str(self._d["sides"])
+
+    def expression(self):
+        """Returns the parsed dice expression of the table, see dice.py."""
+        return parseDice(self.type())
     
     def description(self):
         return self._d["description"]
@@ -43,55 +119,68 @@ class Table(object):
     
     def tableRange(self):
         """Returns the range of numbers that can be rolled on the table as a tuple. So a 2d6 table would have a range (2, 12)."""
-        d = self._d["dice"]
-        return (d, d * self._d["sides"])
-
-    def entryProbability(self, i):
-        return self._entryProbability(i,i)
+        return self.expression().range()
+
+    def distribution(self):
+        """Returns the exact distribution of the table's dice, see dice.py."""
+        return self.expression().distribution()
+
+    def outcomes(self):
+        """Returns a list of (entry, probability) tuples with exact fractions for every distinct entry on the table. Unassigned rolls are gathered under the empty string."""
+        dist = self.distribution()
+        acc = {}
+        for ((a, b), w) in self._d["entries"].items():
+            acc[w] = acc.get(w, 0) + dist.rangeCount(a, b)
+        free = dist.total - sum(acc.values())
+        if free:
+            acc[""] = acc.get("", 0) + free
+        return [(w, Fraction(n, dist.total)) for (w, n) in acc.items() if n]
+
+    def references(self):
+        """Returns the ids of all tables referenced by entries of this table."""
+        acc = []
+        for w in self._d["entries"].values():
+            r = tableReference(w)
+            if (r is not None) and not(r in acc):
+                acc.append(r)
+        return acc
 
-    def entryRangeProbability(self, start, end):
-        return self._entryProbability(start, end)
+    def entryProbability(self, i, digits=2):
+        return self._entryProbability(i, i, digits)
 
+    def entryRangeProbability(self, start, end, digits=2):
+        return self._entryProbability(start, end, digits)
 
-    def _entryProbability(self, start, end):
-        (dice, sides) = (self._d["dice"], self._d["sides"])
-        # we just brute force it by generating all combinations and counting
-        
-        def gen(n, k):
-            fs = range(1, sides+1) # faces
-            if n == 1:
-                return [i+k for i in fs]
-
-            return [gen(n-1, f) for f in fs]
-        nestedResults = gen(dice, 0)
-        while nestedResults and (type(nestedResults[0]) == type([])):
-            acc = []
-            for xs in nestedResults:
-                for x in xs:
-                    acc.append(x)
-                    
-            nestedResults = acc
 
-        return round(len([n for n in nestedResults if ((n >= start) and (n <= end))]) / (sides ** dice), 2) 
+    def _entryProbability(self, start, end, digits=2):
+        """Probability of rolling between start and end, rounded to digits. No rounding if digits is None."""
+        p = self.distribution().rangeProbability(start, end)
+        if digits is None:
+            return p
+        return round(p, digits)
 
 
-    def freeEntries(self):
-        """Returns a list of all slots in the table that are free. Empty if none are free. Does not return a range, only single numbers are considered."""
+    def freeRanges(self):
+        """Returns a list of (start, end) tuples for all gaps in the table that have no entry. Empty if none are free."""
         (lower, upper) = self.tableRange()
         acc = []
-        for i in range(lower, upper+1):
-            add = True
-            for (a, b) in self._d["entries"].keys():
-                if (i >= a) and (i <= b):
-                    add = False
-
-            if add:
-                acc.append(i)
-
+        n = lower
+        for (a, b) in zip(self._starts, self._ends):
+            if a > upper:
+                break
+            if a > n:
+                acc.append((n, a - 1))
+            n = max(n, b + 1)
+        if n <= upper:
+            acc.append((n, upper))
         return acc
 
+    def freeEntries(self):
+        """Returns a list of all slots in the table that are free. Empty if none are free. Does not return a range, only single numbers are considered."""
+        return [i for (a, b) in self.freeRanges() for i in range(a, b+1)]
+
     def dropEntry(self, n):
-        self._dropEntry(n, n)
+        self._dropEntryRange(n, n)
         return
 
     def dropEntryRange(self, start, end):
@@ -102,8 +191,20 @@ class Table(object):
         entries = self._d["entries"]
         if (start, end) in entries:
             del entries[(start, end)]
+            i = bisect_left(self._starts, start)
+            del self._starts[i]
+            del self._ends[i]
+            self._changed()
         return
-    
+
+    def wipe(self):
+        """Removes all entries from the table."""
+        self._d["entries"] = {}
+        self._starts = []
+        self._ends = []
+        self._changed()
+        return
+
     def setEntry(self, n, w):
         return self._setEntry((n,n), w)
 
@@ -117,42 +218,179 @@ class Table(object):
             return False
         
         entries = self._d["entries"]
-        inRange = lambda x: (x >= start) and (x <= end)
-        # check if other entries need to be modified
-        for (a,b) in list(entries):
-            v = entries[(a,b)]
-
-            if inRange(a) and inRange(b):
-                pythoniscool = "donothing"
-            elif inRange(a):
-                entries[(end+1,b)] = v
-            elif inRange(b):
-                entries[(a, start-1)] = v
-            elif (start >= a) and (end <= b):
-                entries[(a, start-1)] = v
-                entries[(end+1, b)] = v
+        starts = self._starts
+        ends = self._ends
+        # entries i to j-1 overlap the new one, as bounds are sorted and don't overlap
+        i = bisect_left(ends, start)
+        j = bisect_right(starts, end)
+        (newStarts, newEnds) = ([], [])
+        if i < j:
+            (a, b) = (starts[i], ends[i])
+            if a < start:
+                # first entry sticks out to the left, keep that part
+                entries[(a, start-1)] = entries[(a, b)]
+                newStarts.append(a)
+                newEnds.append(start-1)
+            (c, d) = (starts[j-1], ends[j-1])
+            v = entries[(c, d)]
+            for k in range(i, j):
+                del entries[(starts[k], ends[k])]
+            if d > end:
+                # last entry sticks out to the right
+                entries[(end+1, d)] = v
+                tail = (end+1, d)
             else:
-                continue
-            del entries[(a,b)]
-            
+                tail = False
+        else:
+            tail = False
+
         # insert new entry
         entries[(start, end)] = w
+        newStarts.append(start)
+        newEnds.append(end)
+        if tail:
+            newStarts.append(tail[0])
+            newEnds.append(tail[1])
+        starts[i:j] = newStarts
+        ends[i:j] = newEnds
+        self._changed()
         return True
 
     def pick(self, n):
         """Pick a number and return the corresponding entry on the table as a string. Empty string if no entry or out of range."""
-        entries = self._d["entries"]
-        for ((a, b), w) in entries.items():
-            if (a <= n) and (b >= n):
-                return entries[(a,b)]
+        i = bisect_right(self._starts, n) - 1
+        if (i >= 0) and (self._ends[i] >= n):
+            return self._d["entries"][(self._starts[i], self._ends[i])]
         return ""
 
-    def roll(self):
-        """Rolls on the table and returns the result string.""" 
-        (a, b) = self.tableRange()
-        return self.pick(randint(a, b))
+    def roll(self, rng=None):
+        """Rolls on the table and returns the result string. In deck mode this draws from the deck instead, empty string if it ran out. rng is an optional random.Random or rng.Stream to roll with.""" 
+        if self.isDeck():
+            w = self.draw(rng)
+            if w is None:
+                return ""
+            return w
+        return self.pick(self.expression().roll(rng))
+
+    #########
+    # Deck mode: every entry is a card and is drawn at most once until the deck is reshuffled
+    #######
+
+    def isDeck(self):
+        return "deck" in self._d
+
+    def setDeck(self, on):
+        if on != self.isDeck():
+            # references to the table don't flatten through a deck, see TableGraph
+            Table.generation += 1
+        if on:
+            self.reshuffle()
+        else:
+            self._d.pop("deck", None)
+        return
 
-    def showTable(self, probabilities=False, showFree=False):
+    def reshuffle(self):
+        """Puts all entries back into the deck, turning on deck mode if it was off."""
+        # cards are the start numbers of the entries, cards[:remaining] are still in the deck
+        cards = list(self._starts)
+        self._d["deck"] = {"cards": cards, "remaining": len(cards), "peeked": False}
+        return
+
+    def deckSize(self):
+        if not(self.isDeck()):
+            return 0
+        return self._d["deck"]["remaining"]
+
+    def _deckTop(self, rng=None):
+        # one step of a Fisher-Yates shuffle, a random remaining card is swapped to the top at index remaining-1.
+        # Once peeked at, the top stays put until it is drawn
+        if not(self.isDeck()):
+            self.reshuffle()
+        deck = self._d["deck"]
+        (cards, n) = (deck["cards"], deck["remaining"])
+        if n == 0:
+            return None
+        if not(deck["peeked"]):
+            j = (rng or random).randrange(n)
+            (cards[j], cards[n-1]) = (cards[n-1], cards[j])
+            deck["peeked"] = True
+        return cards[n-1]
+
+    def peek(self, rng=None):
+        """Returns the entry that the next draw will give, without drawing it. None if the deck is empty."""
+        top = self._deckTop(rng)
+        if top is None:
+            return None
+        return self.pick(top)
+
+    def draw(self, rng=None):
+        """Draws an entry from the deck and returns it. None if the deck is empty."""
+        top = self._deckTop(rng)
+        if top is None:
+            return None
+        deck = self._d["deck"]
+        deck["remaining"] -= 1
+        deck["peeked"] = False
+        return self.pick(top)
+
+    def _compile(self):
+        """Compiles the table into a list of distinct entry strings, a code for every possible roll that indexes into that list, and cumulative weights for the rolls (None if all rolls are equally likely)."""
+        if self._sampler:
+            return self._sampler
+
+        dist = self.distribution()
+        (lower, upper) = dist.range()
+        names = [""]
+        index = {"": 0}
+        codes = [0] * (upper - lower + 1)
+        for (a, b) in zip(self._starts, self._ends):
+            w = self._d["entries"][(a, b)]
+            (a, b) = (max(a, lower), min(b, upper))
+            if a > b:
+                continue
+            if not(w in index):
+                index[w] = len(names)
+                names.append(w)
+            codes[a - lower:b - lower + 1] = [index[w]] * (b - a + 1)
+
+        if len(set(dist.counts)) == 1:
+            weights = None
+        else:
+            weights = dist.cumulative[1:]
+
+        if numpy:
+            codes = numpy.array(codes, dtype=numpy.int64)
+            if weights:
+                weights = numpy.array([c / dist.total for c in weights])
+        self._sampler = (names, codes, weights)
+        return self._sampler
+
+    def _rollCodes(self, n, rng=None):
+        (names, codes, weights) = self._compile()
+        r = rng or random
+        if numpy:
+            gen = numpy.random.default_rng(r.randrange(2**63))
+            if weights is None:
+                return codes[gen.integers(0, len(codes), n)]
+            return codes[numpy.minimum(numpy.searchsorted(weights, gen.random(n), side="right"), len(codes) - 1)]
+        return r.choices(codes, cum_weights=weights, k=n)
+
+    def rollMany(self, n, rng=None):
+        """Rolls n times on the table and returns a list of the result strings."""
+        names = self._compile()[0]
+        return [names[c] for c in self._rollCodes(n, rng)]
+
+    def histogram(self, n, rng=None):
+        """Rolls n times on the table and returns a Counter of how often each entry came up. Empty rolls count towards the empty string."""
+        names = self._compile()[0]
+        if numpy:
+            counts = numpy.bincount(self._rollCodes(n, rng), minlength=len(names))
+            return Counter({names[i]: int(counts[i]) for i in range(len(names)) if counts[i]})
+        counts = Counter(self._rollCodes(n, rng))
+        return Counter({names[c]: k for (c, k) in counts.items()})
+
+    def showTable(self, probabilities=False, showFree=False, leaves=None):
+        """Returns the table as a string. If leaves is a list of (outcome, probability) tuples, e.g. from TableGraph.leaves, they are listed after the entries."""
         w = ""
         dice = self._d["dice"]
         sides = self._d["sides"]
@@ -161,7 +399,7 @@ class Table(object):
         l = len(dicestring) + 2
         w += (l * "-") + "+" + (12 * "-") + "\n"
         if showFree:
-            fs = map(lambda e: ((e, e), ""), self.freeEntries())
+            fs = map(lambda e: (e, ""), self.freeRanges())
             entryList = sorted(list(self._d["entries"].items()) + list(fs))
         else:
             entryList = sorted(self._d["entries"].items())
@@ -174,11 +412,322 @@ class Table(object):
             w += numstring + ((l - len(numstring)) * " ") + "| " + entry 
             if probabilities and (entry != ""):
                 w += " (" + str(100 * self.entryRangeProbability(a, b)) + "%)"
-                w += "\n"
+            w += "\n"
+        if leaves:
+            w += (l * "-") + "+" + (12 * "-") + "\n"
+            w += " Outcomes after rolling on all referenced tables:\n"
+            for (leaf, p) in sorted(leaves, key=lambda x: -x[1]):
+                w += "  " + (leaf or "(no entry)") + " (" + str(round(100 * float(p), 2)) + "%)\n"
         return w
     
-    def printTable(self, probabilities=False, showFree=False):
-        print(self.showTable(probabilities, showFree))
+    def printTable(self, probabilities=False, showFree=False, leaves=None):
+        print(self.showTable(probabilities, showFree, leaves))
+
+
+
+def solveRanges(t, targets):
+    """Assigns contiguous ranges of the dice table t to entries so their probabilities match target weights as well as possible,
+    i.e. with the least sum of the differences between the probability and the target of every entry.
+    targets is a list of (weight, entry) tuples in table order. Returns a list of ((start, end), entry, probability) tuples,
+    or None if there are more entries than results on the table. Runs in time linear in the table range times the number of entries."""
+    dist = t.distribution()
+    (lower, upper) = dist.range()
+    n = upper - lower + 1
+    m = len(targets)
+    if (m == 0) or (m > n):
+        return None
+
+    total = sum([weight for (weight, w) in targets])
+    # c[j] is the probability of rolling one of the first j results, an entry covering results i to j - 1 has c[j] - c[i]
+    c = [k / dist.total for k in dist.cumulative]
+    inf = float("inf")
+    # best[j] is the least error of the entries so far covering the first j results, cuts[k][j] where the last of them starts
+    best = [0] + [inf] * n
+    cuts = []
+    for (k, (weight, w)) in enumerate(targets):
+        target = weight / total
+        new = [inf] * (n + 1)
+        cut = [0] * (n + 1)
+        # the error of an entry from i to j is c[j] - c[i] - target while that is positive, and target - c[j] + c[i] after that.
+        # The i of the first case are a prefix growing with j, the others a window sliding with j, so both minimums are kept incrementally
+        prefix = (inf, 0)
+        p = k
+        window = deque()
+        for j in range(k + 1, n - (m - 1 - k) + 1):
+            while (p < j) and (c[j] - c[p] >= target):
+                if best[p] - c[p] < prefix[0]:
+                    prefix = (best[p] - c[p], p)
+                p += 1
+            i = j - 1
+            if best[i] < inf:
+                while window and (best[window[-1]] + c[window[-1]] >= best[i] + c[i]):
+                    window.pop()
+                window.append(i)
+            while window and (window[0] < p):
+                window.popleft()
+            if prefix[0] + c[j] - target < new[j]:
+                (new[j], cut[j]) = (prefix[0] + c[j] - target, prefix[1])
+            if window and (best[window[0]] + c[window[0]] - c[j] + target < new[j]):
+                (new[j], cut[j]) = (best[window[0]] + c[window[0]] - c[j] + target, window[0])
+        best = new
+        cuts.append(cut)
+
+    acc = []
+    j = n
+    for k in range(m - 1, -1, -1):
+        i = cuts[k][j]
+        (start, end) = (lower + i, lower + j - 1)
+        acc.append(((start, end), targets[k][1], dist.rangeProbability(start, end)))
+        j = i
+    acc.reverse()
+    return acc
+
+def applyRanges(t, solution):
+    """Writes a solution of solveRanges to the table."""
+    for ((a, b), w, p) in solution:
+        t.setEntryRange(a, b, w)
+    return
+
+class WeightedTable(object):
+    """A table whose entries have arbitrary weights instead of dice ranges, e.g. 70 nothing, 20 goblins, 10 ogre.
+    Rolls use the alias method, so they take constant time however many entries there are. The alias table is rebuilt lazily after an entry changes."""
+    def fromDict(d):
+        t = WeightedTable(d["name"], d.get("description", ""))
+        for (weight, w) in d["entries"]:
+            t.addEntry(weight, w)
+        return t
+
+    def toDict(self):
+        return {"kind": "weighted", "version": TABLEVERSION, "name": self._name, "description": self._description, "entries": [[weight, w] for (weight, w) in self._entries]}
+
+    def __init__(self, name, desc=""):
+        self._name = name
+        self._description = desc
+        # list of (weight, entry) tuples
+        self._entries = []
+        self._alias = None
+
+    def name(self):
+        return self._name
+
+    def type(self):
+        return "weighted"
+
+    def description(self):
+        return self._description
+
+    def setDescription(self, desc):
+        self._description = desc
+        return
+
+    def isDeck(self):
+        return False
+
+    def _changed(self):
+        self._alias = None
+        Table.generation += 1
+
+    def entries(self):
+        return list(self._entries)
+
+    def addEntry(self, weight, w):
+        """Adds an entry with a positive weight. Returns False if the weight is not positive."""
+        if not(weight > 0):
+            return False
+        self._entries.append((weight, w))
+        self._changed()
+        return True
+
+    def setEntry(self, i, weight, w):
+        if not(weight > 0) or not(0 <= i < len(self._entries)):
+            return False
+        self._entries[i] = (weight, w)
+        self._changed()
+        return True
+
+    def dropEntry(self, i):
+        if 0 <= i < len(self._entries):
+            del self._entries[i]
+            self._changed()
+        return
+
+    def wipe(self):
+        self._entries = []
+        self._changed()
+        return
+
+    def totalWeight(self):
+        return sum([weight for (weight, w) in self._entries])
+
+    def entryProbability(self, i):
+        return self._entries[i][0] / self.totalWeight()
+
+    def outcomes(self):
+        """Returns a list of (entry, probability) tuples with exact fractions for every distinct entry, like Table.outcomes."""
+        total = Fraction(self.totalWeight())
+        acc = {}
+        for (weight, w) in self._entries:
+            acc[w] = acc.get(w, 0) + Fraction(weight) / total
+        return list(acc.items())
+
+    def references(self):
+        acc = []
+        for (weight, w) in self._entries:
+            r = tableReference(w)
+            if (r is not None) and not(r in acc):
+                acc.append(r)
+        return acc
+
+    def _buildAlias(self):
+        # Vose's alias method: every slot i holds a probability prob[i] of its own entry, and alias[i] for the rest
+        n = len(self._entries)
+        total = self.totalWeight()
+        scaled = [weight * n / total for (weight, w) in self._entries]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        # whatever is left over is 1 up to rounding errors
+        self._alias = (prob, alias)
+
+    def _rollIndex(self, rng=None):
+        if self._alias is None:
+            self._buildAlias()
+        (prob, alias) = self._alias
+        r = rng or random
+        i = r.randrange(len(prob))
+        if r.random() < prob[i]:
+            return i
+        return alias[i]
+
+    def roll(self, rng=None):
+        """Rolls on the table and returns the result string. Empty string if the table has no entries."""
+        if not(self._entries):
+            return ""
+        return self._entries[self._rollIndex(rng)][1]
+
+    def rollMany(self, n, rng=None):
+        if not(self._entries):
+            return [""] * n
+        return [self._entries[self._rollIndex(rng)][1] for i in range(n)]
+
+    def histogram(self, n, rng=None):
+        return Counter(self.rollMany(n, rng))
+
+    def showTable(self, probabilities=False, showFree=False, leaves=None):
+        """Returns the table as a string, see Table.showTable. showFree has no meaning for weighted tables."""
+        w = " # | weight | " + self._name + "\n"
+        w += "---+--------+" + (12 * "-") + "\n"
+        total = self.totalWeight()
+        for (i, (weight, entry)) in enumerate(self._entries):
+            numstring = " " + str(i)
+            weightstring = " " + str(weight)
+            w += numstring + ((3 - len(numstring)) * " ") + "|" + weightstring + ((8 - len(weightstring)) * " ") + "| " + entry
+            if probabilities:
+                w += " (" + str(round(100 * weight / total, 2)) + "%)"
+            w += "\n"
+        if leaves:
+            w += "---+--------+" + (12 * "-") + "\n"
+            w += " Outcomes after rolling on all referenced tables:\n"
+            for (leaf, p) in sorted(leaves, key=lambda x: -x[1]):
+                w += "  " + (leaf or "(no entry)") + " (" + str(round(100 * float(p), 2)) + "%)\n"
+        return w
+
+    def printTable(self, probabilities=False, showFree=False, leaves=None):
+        print(self.showTable(probabilities, showFree, leaves))
+
+
+def tableFromDict(d):
+    """Decodes a table written by toDict, either a dice Table or a WeightedTable."""
+    if d.get("kind") == "weighted":
+        return WeightedTable.fromDict(d)
+    return Table.fromDict(d)
+
+
+class LazyTables(MutableMapping):
+    """Dictionary of table ids to tables that keeps tables encoded as in the dungeon file until they are used.
+    Tables that are never looked at, e.g. duplicates when merging a table library, are never decoded."""
+    def __init__(self, encoded=None, tables=None):
+        # any mapping of ids to encoded tables, e.g. one reading them from a database, see sqlstore.py
+        if encoded is None:
+            encoded = {}
+        self._encoded = encoded
+        self._tables = dict(tables or {})
+        # the ids in order, None after a table was added or deleted
+        self._ids = None
+
+    def __getitem__(self, k):
+        if k in self._tables:
+            return self._tables[k]
+        t = tableFromDict(self._encoded[k])
+        del self._encoded[k]
+        self._tables[k] = t
+        return t
+
+    def __setitem__(self, k, t):
+        if not(k in self):
+            self._ids = None
+        self._encoded.pop(k, None)
+        self._tables[k] = t
+
+    def __delitem__(self, k):
+        if k in self._tables:
+            del self._tables[k]
+        else:
+            del self._encoded[k]
+        self._ids = None
+
+    def __contains__(self, k):
+        return (k in self._tables) or (k in self._encoded)
+
+    def __iter__(self):
+        # in id order, whichever tables were decoded, so listings and saved files don't depend on what was rolled.
+        # Tables are still only decoded when they are looked up
+        if self._ids is None:
+            self._ids = sorted(list(self._tables) + list(self._encoded))
+        for k in list(self._ids):
+            yield k
+
+    def __len__(self):
+        return len(self._tables) + len(self._encoded)
+
+    def encoded(self, k):
+        """The table as it is stored in the dungeon file, without decoding it if it wasn't used."""
+        if k in self._encoded:
+            return self._encoded[k]
+        return self._tables[k].toDict()
+
+    def setEncoded(self, k, d):
+        if not(k in self):
+            self._ids = None
+        self._tables.pop(k, None)
+        self._encoded[k] = d
+
+    def describe(self, k):
+        """Returns a tuple of name and type of a table, without decoding it."""
+        if k in self._tables:
+            t = self._tables[k]
+            return (t.name(), t.type())
+        d = self._encoded[k]
+        return (d["name"], tableType(d))
+
+    def listing(self, k):
+        """Returns a tuple of name, type and description of a table, without decoding it."""
+        if k in self._tables:
+            t = self._tables[k]
+            return (t.name(), t.type(), t.description())
+        d = self._encoded[k]
+        return (d["name"], tableType(d), d.get("description", ""))
 
 
 
@@ -187,39 +736,83 @@ class Table(object):
 #######
 
 def getDiceInput():
+    """Prompts for a dice expression and returns it parsed, see dice.py. Returns None for a weighted table."""
     while True:
-        ws = input("Enter type of table, e.g. 1d8, 2d6, 1d100 etc.").split("d")
-        if (len(ws) != 2):
-            continue
-
+        w = input("Enter type of table, e.g. 1d8, 2d6, 1d100, 3d6+2, 4d6kh3 etc. or w for a weighted table.")
+        if w in ["w", "weighted"]:
+            return None
         try:
-            dice = int(ws[0])
-            sides = int(ws[1])
+            e = parseDice(w)
         except ValueError:
             continue
 
-        if (sides < 1) or (dice < 1):
+        if not([t for t in e.terms if t.sides > 0]):
             continue
 
-        return (dice, sides)
+        return e
 
 def addEntryDialogue(t, entry=False):
     if entry:
         e = entry
     else:
-        es = t.freeEntries()
+        es = t.freeRanges()
         if not(es):
             return False
-        e = (es[0], es[0])
+        e = (es[0][0], es[0][0])
 
     if e[0] != e[1]:
         msg = "Enter text for entries " + str(e[0]) + " - " + str(e[1])
     else:
         msg ="Enter text for entry " + str(e[0])
-        w = input(msg + " (probability " + str(t.entryRangeProbability(e[0], e[1])) + "):")
-        t.setEntryRange(e[0], e[1], w)
+    w = input(msg + " (probability " + str(t.entryRangeProbability(e[0], e[1])) + "):")
+    t.setEntryRange(e[0], e[1], w)
     return True
 
+def showSolution(solution, targets):
+    total = sum([weight for (weight, w) in targets])
+    w = ""
+    for (((a, b), entry, p), (weight, x)) in zip(solution, targets):
+        if a == b:
+            numstring = " " + str(a)
+        else:
+            numstring = " " + str(a) + " - " + str(b)
+        w += numstring + " | " + entry + " (" + str(round(100 * p, 2)) + "%, wanted " + str(round(100 * weight / total, 2)) + "%)\n"
+    return w
+
+def solveDialogue(t):
+    """Prompts for entries with target weights and fits ranges to them, showing the achieved probabilities after every line."""
+    print("Enter a weight and a text per line, e.g. '50 goblins', in table order. An empty line ends input.")
+    targets = []
+    solution = None
+    while True:
+        inp = input()
+        if not(inp):
+            break
+        e = weightedEntryInput(inp)
+        if not(e):
+            print("Could not parse that. Enter a weight and a text, e.g. '50 goblins'.")
+            continue
+        targets.append(e)
+        solution = solveRanges(t, targets)
+        if solution is None:
+            print("The table has fewer results than entries, dropping the last one.")
+            targets.pop()
+            solution = solveRanges(t, targets)
+            continue
+        print(showSolution(solution, targets))
+
+    if solution and yesnoInput("Write these ranges to the table?"):
+        applyRanges(t, solution)
+    return
+
+def yesnoInput(prompt):
+    while True:
+        w = input(prompt + " [y/n]:")
+        if w == "y":
+            return True
+        if w == "n":
+            return False
+
 def addAllEntriesDialogue(t):
     while addEntryDialogue(t):
         pythoniscool = True
@@ -247,7 +840,7 @@ def editEntryDialogue(t, start, end):
     if inp == "q":
         return
     elif inp == "!d":
-        del entries[(start, end)]
+        t.dropEntryRange(start, end)
         return
 
     t.setEntryRange(start, end, inp)
@@ -265,7 +858,8 @@ def listFromRangeExpression(w):
 
     return [int(ws[0]), int(ws[1])]
 
-def editTableDialogue(t):
+def editTableDialogue(t, leaves=None):
+    """Interactive editing of table t. leaves is an optional function returning the outcome probabilities through referenced tables, to be shown with the table."""
     inp = ""
     while inp != "q":
         if inp.isnumeric():
@@ -281,7 +875,7 @@ def editTableDialogue(t):
         elif inp == "!fill":
             addAllEntriesDialogue(t)
         elif inp == "!paste":
-            es = t.freeEntries()
+            es = t.freeRanges()
             if not(es):
                 print("No free entries available for pasting. Try !wipe to make space.")
             else:
@@ -294,24 +888,86 @@ def editTableDialogue(t):
                     else:
                         break
                     
-                es.reverse()
+                free = (n for (a, b) in es for n in range(a, b+1))
                 for i in range(len(ws)):
-                    if not(es):
+                    e = next(free, None)
+                    if e is None:
                         print("No more free entries. " + str(len(ws) - i) + "input lines discarded.")
                         break
-                    e = es.pop()
                     t.setEntryRange(e,e, ws[i])
         elif inp == "!wipe":
-            t._d["entries"] = {}
+            t.wipe()
+        elif inp == "!solve":
+            solveDialogue(t)
 
 
-        t.printTable(True, True)
-        inp = input("Enter a number or a range to edit. !wipe to wipe the table, !fill to prompt for every row. !paste to bluk fill table. q to quit.")
+        t.printTable(True, True, leaves() if leaves else None)
+        inp = input("Enter a number or a range to edit. !wipe to wipe the table, !fill to prompt for every row. !paste to bluk fill table. !solve to fit ranges to target probabilities. q to quit.")
+    return
+
+def weightedEntryInput(w):
+    """Parses input like '70 nothing' into a tuple of weight and entry. None if there is no positive weight."""
+    ws = w.split(" ", 1)
+    try:
+        weight = float(ws[0])
+    except ValueError:
+        return None
+    if weight.is_integer():
+        weight = int(weight)
+    if not(weight > 0):
+        return None
+    if len(ws) == 1:
+        return (weight, "")
+    return (weight, ws[1].strip())
+
+def editWeightedTableDialogue(t, leaves=None):
+    """Interactive editing of a WeightedTable, see editTableDialogue."""
+    inp = ""
+    while inp != "q":
+        if inp.isnumeric():
+            i = int(inp)
+            if i >= len(t.entries()):
+                print("That's not on the table!")
+            else:
+                (weight, w) = t.entries()[i]
+                print(" " + str(i) + " | " + str(weight) + " | " + w + "\nType new weight and text to edit, e.g. '20 goblins'. !d to drop entry. q to quit.\n")
+                inp = input()
+                if inp == "!d":
+                    t.dropEntry(i)
+                elif inp != "q":
+                    e = weightedEntryInput(inp)
+                    if e:
+                        t.setEntry(i, e[0], e[1])
+                    else:
+                        print("Could not parse that, try '20 goblins'.")
+        elif inp == "!wipe":
+            t.wipe()
+        elif inp:
+            e = weightedEntryInput(inp)
+            if e:
+                t.addEntry(e[0], e[1])
+            else:
+                print("Could not parse that. Enter a weight and a text, e.g. '70 nothing'.")
+
+        t.printTable(True, False, leaves() if leaves else None)
+        inp = input("Enter a weight and a text to add an entry, e.g. '70 nothing'. A number alone edits that entry. !wipe to wipe the table. q to quit.")
+    return
+
+def editAnyTableDialogue(t, leaves=None):
+    if isinstance(t, WeightedTable):
+        editWeightedTableDialogue(t, leaves)
+    else:
+        editTableDialogue(t, leaves)
     return
 
 def mkTableDialogue():
     name = input("Table name?")
-    (dice, sides) = getDiceInput()
+    e = getDiceInput()
     desc = input("Short table description:")
-    return Table(dice, sides, name, desc)
+    if e is None:
+        return WeightedTable(name, desc)
+    t = [t for t in e.terms if t.sides > 0][0]
+    if (len(e.terms) == 1) and (t.sign > 0) and (t.keep is None):
+        return Table(t.dice, t.sides, name, desc)
+    return Table(t.dice, t.sides, name, desc, str(e))
         
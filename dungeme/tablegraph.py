@@ -0,0 +1,102 @@
+#!/bin/python3
+#
+# tablegraph.py
+#
+# Compiles tables that reference other tables into flat outcome distributions
+
+import random
+from table import Table, tableReference
+
+class TableGraph(object):
+    """Resolves references between tables, i.e. entries of the form @TABLEID. Every table is flattened once into the distribution of its final outcomes, so rolling through a chain of tables is a single draw. Caches are dropped whenever any table changes.
+    A reference to a table in deck mode stays an outcome of its own, the caller draws from that deck, see State._tableRoll."""
+    def __init__(self, tables):
+        self.tables = tables
+        self._generation = None
+        self._flat = {}
+        self._samplers = {}
+
+    def invalidate(self):
+        self._generation = None
+        return
+
+    def _check(self):
+        if self._generation != Table.generation:
+            self._flat = {}
+            self._samplers = {}
+            self._generation = Table.generation
+        return
+
+    def findCycle(self, tableId):
+        """Returns a list of table ids forming a cycle reachable from tableId, e.g. [1, 2, 1]. Empty list if there is none."""
+        # iterative depth first search, path holds the tables currently being visited
+        done = set()
+        path = [tableId]
+        onPath = {tableId}
+        stack = [iter(self._references(tableId))]
+        while stack:
+            r = next(stack[-1], None)
+            if r is None:
+                stack.pop()
+                t = path.pop()
+                onPath.discard(t)
+                done.add(t)
+                continue
+            if r in onPath:
+                return path[path.index(r):] + [r]
+            if (r in done) or not(r in self.tables):
+                continue
+            path.append(r)
+            onPath.add(r)
+            stack.append(iter(self._references(r)))
+        return []
+
+    def _references(self, tableId):
+        if not(tableId in self.tables):
+            return []
+        return self.tables[tableId].references()
+
+    def _flatten(self, tableId):
+        if tableId in self._flat:
+            return self._flat[tableId]
+
+        acc = {}
+        for (w, p) in self.tables[tableId].outcomes():
+            r = tableReference(w)
+            if (r is None) or not(r in self.tables) or self.tables[r].isDeck():
+                acc[w] = acc.get(w, 0) + p
+                continue
+            for (leaf, q) in self._flatten(r).items():
+                acc[leaf] = acc.get(leaf, 0) + p * q
+
+        self._flat[tableId] = acc
+        return acc
+
+    def leaves(self, tableId):
+        """Returns a list of (outcome, probability) tuples with exact fractions for every final outcome of rolling on tableId. None if the table does not exist or its references form a cycle."""
+        self._check()
+        if not(tableId in self.tables) or self.findCycle(tableId):
+            return None
+        return list(self._flatten(tableId).items())
+
+    def roll(self, tableId, rng=None):
+        """Rolls on tableId, following references to other tables. Returns the result string, None on a cycle or a missing table and an empty string for a table without entries. rng is an optional random.Random or rng.Stream to roll with."""
+        self._check()
+        if not(tableId in self._samplers):
+            leaves = self.leaves(tableId)
+            if leaves is None:
+                return None
+            # an empty weighted table, or references only to those, has no outcomes
+            leaves = [(w, p) for (w, p) in leaves if p > 0]
+            names = [w for (w, p) in leaves]
+            acc = 0
+            weights = []
+            for (w, p) in leaves:
+                acc += p
+                weights.append(float(acc))
+            self._samplers[tableId] = (names, weights)
+        (names, weights) = self._samplers[tableId]
+        if not(names):
+            # like a free slot of a Table
+            return ""
+        return (rng or random).choices(names, cum_weights=weights)[0]
@@ -0,0 +1,187 @@
+#!/bin/python3
+#
+# tableimport.py
+#
+# Streaming import of random tables from org-mode and CSV files.
+#
+# org-mode: every heading starts a table named after the heading. Its entries are either the lines
+# following the heading up to the first empty line, or an org table whose first column is a roll or a range like 1-4
+# (its header may name the dice, e.g. | d8 | Item |). A list item may end in a tab and a value like 1,000 gp, which isn't part of
+# the entry. If that value differs from the one of the table so far, a new table starts from that item on, e.g. in rules/gems.org.
+# CSV: rows of TABLE,ENTRY or TABLE,RANGE,ENTRY. Consecutive rows with the same table name form one table.
+
+import csv
+from table import Table, listFromRangeExpression
+from dice import parseDice
+
+STANDARDDICE = [2, 3, 4, 6, 8, 10, 12, 20, 100]
+
+def inferDice(n):
+    """Returns the sides of a single die for a table with n entries. A standard die if one has exactly n sides or a multiple of n,
+    so every entry covers the same number of results, otherwise a die with n sides."""
+    for sides in STANDARDDICE:
+        if (sides >= n) and (sides % n == 0):
+            return sides
+    return n
+
+def tableFromItems(name, items):
+    """Makes a 1dN table out of a list of entries, every entry covering equally many results."""
+    sides = inferDice(len(items))
+    width = sides // len(items)
+    t = Table(1, sides, name)
+    for (i, w) in enumerate(items):
+        t.setEntryRange(i * width + 1, (i + 1) * width, w)
+    return t
+
+def tableFromRanges(name, rows, dice=None):
+    """Makes a table out of a list of ((start, end), entry) tuples. dice is a dice expression, if not given a single die up to the highest range is used."""
+    if dice is None:
+        dice = "1d" + str(max([b for ((a, b), w) in rows]))
+    e = parseDice(dice)
+    term = [t for t in e.terms if t.sides > 0][0]
+    if (len(e.terms) == 1) and (term.keep is None):
+        t = Table(term.dice, term.sides, name)
+    else:
+        t = Table(term.dice, term.sides, name, "", str(e))
+    for ((a, b), w) in rows:
+        t.setEntryRange(a, b, w)
+    return t
+
+def _rollCell(w):
+    # a roll like 4 or a range like 1-4 (or 1–4) in a table cell, None if it's neither
+    w = w.strip().replace("–", "-")
+    if w.isnumeric():
+        return (int(w), int(w))
+    ns = listFromRangeExpression(w)
+    if ns:
+        return (ns[0], ns[1])
+    return None
+
+def _diceCell(w):
+    # a header cell like d8 or 2d6, None if it isn't one
+    w = w.strip().lower()
+    if w.startswith("d"):
+        w = "1" + w
+    try:
+        parseDice(w)
+    except ValueError:
+        return None
+    if not("d" in w):
+        return None
+    return w
+
+def parseGp(w):
+    """Parses a value like '1,000 gp' into an int. None if it isn't one."""
+    w = w.strip()
+    if not(w.endswith("gp")):
+        return None
+    w = w[:-2].strip().replace(",", "")
+    if not(w.isnumeric()):
+        return None
+    return int(w)
+
+def _headingValue(heading):
+    # the value a heading like '500 gp gems' starts with, None if it doesn't
+    return parseGp(" ".join(heading.split()[:2]))
+
+def _valueName(heading, w):
+    # name of the table split off from heading at an item with value w, e.g. '1,000 gp gems' from '500 gp gems'
+    if _headingValue(heading) is None:
+        return heading + " " + w
+    return " ".join([w] + heading.split()[2:])
+
+def _orgBlock(name, items, rows, dice):
+    if rows:
+        return tableFromRanges(name, rows, dice)
+    if items:
+        return tableFromItems(name, items)
+    return None
+
+def readOrg(lines):
+    """Generator over the tables in the lines of an org-mode file. Only the current table is kept in memory."""
+    (name, items, rows, dice) = (None, [], [], None)
+    (heading, value) = (None, None)
+    ended = False
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("*") and line.lstrip("*").startswith(" "):
+            if name is not None:
+                t = _orgBlock(name, items, rows, dice)
+                if t:
+                    yield t
+            (name, items, rows, dice) = (line.lstrip("*").strip(), [], [], None)
+            (heading, value) = (name, _headingValue(name))
+            ended = False
+            continue
+        if (name is None) or ended:
+            continue
+
+        s = line.strip()
+        if not(s):
+            # an empty line ends the list, anything after it is commentary
+            ended = bool(items or rows)
+        elif s.startswith("|"):
+            cells = s.strip("|").split("|")
+            if s.startswith("|-") or (len(cells) < 2):
+                continue
+            bounds = _rollCell(cells[0])
+            if bounds is None:
+                # header row
+                dice = dice or _diceCell(cells[0])
+                continue
+            rows.append((bounds, " - ".join([c.strip() for c in cells[1:] if c.strip()])))
+        elif not(rows):
+            ws = s.split("\t")
+            v = parseGp(ws[-1]) if len(ws) > 1 else None
+            if v is not None:
+                s = "\t".join(ws[:-1]).strip()
+                if (v != value) and items:
+                    # a new tier starts with this item
+                    yield _orgBlock(name, items, rows, dice)
+                    (name, items) = (_valueName(heading, ws[-1].strip()), [])
+                value = v
+            items.append(s)
+
+    if name is not None:
+        t = _orgBlock(name, items, rows, dice)
+        if t:
+            yield t
+
+def readCsv(lines):
+    """Generator over the tables in the lines of a CSV file with TABLE,ENTRY or TABLE,RANGE,ENTRY rows."""
+    (name, items, rows) = (None, [], [])
+    for row in csv.reader(lines):
+        if not(row) or ((name is None) and (row[0].strip().lower() == "table")):
+            # empty row or header
+            continue
+        if row[0] != name:
+            if name is not None:
+                t = _orgBlock(name, items, rows, None)
+                if t:
+                    yield t
+            (name, items, rows) = (row[0], [], [])
+        if len(row) >= 3:
+            bounds = _rollCell(row[1])
+            if bounds:
+                rows.append((bounds, ",".join(row[2:]).strip()))
+                continue
+        if len(row) >= 2:
+            items.append(",".join(row[1:]).strip())
+
+    if name is not None:
+        t = _orgBlock(name, items, rows, None)
+        if t:
+            yield t
+
+def readTables(filename):
+    """Generator over the tables in an org-mode or CSV file, picked by the file extension."""
+    f = open(filename, newline="")
+    try:
+        if filename.lower().endswith(".csv"):
+            for t in readCsv(f):
+                yield t
+        else:
+            for t in readOrg(f):
+                yield t
+    finally:
+        f.close()
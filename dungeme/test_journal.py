@@ -0,0 +1,53 @@
+#!/bin/python3
+#
+# test_journal.py
+#
+# Tests for saving through the journal of dungeme.py and loading through its cache, run with pytest
+
+import os
+from dungeme import State, createDungeonfile, journalFile
+
+def _dungeon(tmp_path):
+    filename = str(tmp_path / "dungeon.js")
+    createDungeonfile(filename)
+    return filename
+
+def test_journal_is_replayed(tmp_path):
+    filename = _dungeon(tmp_path)
+    s = State.fromFile(filename)
+    s._note("0", "a")
+    s.save()
+    assert State.fromFile(filename).data["rooms"]["0"]["notes"] == ["a"]
+
+def test_saves_after_a_cut_off_record_survive(tmp_path):
+    filename = _dungeon(tmp_path)
+    s = State.fromFile(filename)
+    s._note("0", "a")
+    s.save()
+    f = open(journalFile(filename), "a")
+    f.write('[2, "rooms", "0", {"id": "0", "na')
+    f.close()
+
+    s = State.fromFile(filename)
+    assert s.data["rooms"]["0"]["notes"] == ["a"]
+    s._note("0", "b")
+    s.save()
+    s = State.fromFile(filename)
+    assert s.data["rooms"]["0"]["notes"] == ["a", "b"]
+    s._note("0", "c")
+    s.save()
+    assert State.fromFile(filename).data["rooms"]["0"]["notes"] == ["a", "b", "c"]
+
+def test_cache_sees_edits_that_keep_time_and_size(tmp_path):
+    filename = _dungeon(tmp_path)
+    s = State.fromFile(filename)
+    s._note("0", "a")
+    s.snapshot()
+    assert State.fromFile(filename).data["rooms"]["0"]["notes"] == ["a"]
+    st = os.stat(filename)
+    w = open(filename).read()
+    f = open(filename, "w")
+    f.write(w.replace('["a"]', '["b"]'))
+    f.close()
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert State.fromFile(filename).data["rooms"]["0"]["notes"] == ["b"]
@@ -0,0 +1,53 @@
+#!/bin/python3
+#
+# test_tablegraph.py
+#
+# Tests for rolling through tablegraph.py, run with pytest
+
+from table import Table, WeightedTable
+from tablegraph import TableGraph
+from rng import Stream
+from dungeme import State, createDungeonfile
+
+def test_empty_weighted_table_rolls_empty():
+    g = TableGraph({1 : WeightedTable("empty")})
+    assert g.roll(1, Stream(1)) == ""
+
+def test_reference_to_empty_weighted_table_rolls_empty():
+    t = Table(1, 6, "1d6")
+    t.setEntryRange(1, 6, "@2")
+    g = TableGraph({1 : t, 2 : WeightedTable("empty")})
+    assert g.roll(1, Stream(1)) == ""
+
+def test_weighted_table_rolls_its_entries():
+    t = WeightedTable("w")
+    t.addEntry(3, "goblin")
+    t.addEntry(1, "ogre")
+    g = TableGraph({1 : t})
+    assert set([g.roll(1, Stream(i)) for i in range(50)]) == {"goblin", "ogre"}
+
+def test_reference_to_deck_stays_an_outcome():
+    t = Table(1, 6, "1d6")
+    t.setEntryRange(1, 6, "@2")
+    deck = Table(1, 2, "1d2")
+    deck.setEntryRange(1, 1, "sword")
+    deck.setEntryRange(2, 2, "shield")
+    deck.setDeck(True)
+    g = TableGraph({1 : t, 2 : deck})
+    assert g.roll(1, Stream(1)) == "@2"
+
+def test_reference_draws_from_deck(tmp_path):
+    filename = str(tmp_path / "dungeon.js")
+    createDungeonfile(filename)
+    s = State.fromFile(filename)
+    t = Table(1, 6, "1d6")
+    t.setEntryRange(1, 6, "@2")
+    deck = Table(1, 2, "1d2")
+    deck.setEntryRange(1, 1, "sword")
+    deck.setEntryRange(2, 2, "shield")
+    deck.setDeck(True)
+    s.tables[1] = t
+    s.tables[2] = deck
+    s._tablesChanged()
+    assert sorted([s._tableRoll(1), s._tableRoll(1)]) == ["shield", "sword"]
+    assert s._tableRoll(1) == ""
@@ -7,6 +7,25 @@ from collections import Counter
 import random
 from math import *
 from copy import deepcopy
+import os.path
+import sys
+import importlib.util
+from multiprocessing import Pool
+
+def _dungemeModule(name):
+    # loads a module of dungeme by its file, like import would, without putting all of dungeme on sys.path
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dungeme", name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    # worker processes unpickle streams by their module name
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# the dice expression library and the random streams live with dungeme
+parseDice = _dungemeModule("dice").parseDice
+Stream = _dungemeModule("rng").Stream
 
 
 ENCOUNTERGENERATEHELP = """
@@ -16,6 +35,7 @@ After setup, the generator enters a REPL where you can enter the following
 <newline> - (i.e. no input) Generate another encounter randomly, observing the current filter and xp threshold parameters
 clear - Clear the current filter and generate another encounter
 pick NAME1:N1[,NAME2:N2...] - Enter a new filter, generating only encounters that include the specified number (N) of monsters named NAME
+many N - Generate N encounters at once on all cores, observing the current filter, and list them
 
 Examples:
 pick kobold:1
@@ -26,6 +46,16 @@ pick priest:1,cultist:5
 
 
 
+def damageSummary(d):
+    """Returns a string with average and maximum damage of an action with damage_dice, e.g. ' (avg 12, max 17)'. Empty string if the dice can't be parsed."""
+    try:
+        e = parseDice(d["damage_dice"])
+    except ValueError:
+        return ""
+    bonus = d.get("damage_bonus") or 0
+    return " (avg " + str(floor(e.average() + bonus)) + ", max " + str(e.maximum() + bonus) + ")"
+
+
 def mkShortStats(d):
     w = " . "
     w += str(d["hit_points"]) + " HP " + str(d["armor_class"]) + " AC "
@@ -41,6 +71,9 @@ def mkShortStats(d):
         if "damage_bonus" in d.keys():
             w += " +" + str(d["damage_bonus"])
 
+        if "damage_dice" in d.keys():
+            w += damageSummary(d)
+
     return w
 
 
@@ -265,10 +298,12 @@ def groupMultiplier(n):
 def encounterXP(encounter):
     return sum([xpPerCR(hackFloat(d.get("challenge_rating", 0.0))) for d in encounter])
         
-def generateOne(candidates, difficulty, xpThresholds, origEncounter=[]):
+def generateOne(candidates, difficulty, xpThresholds, origEncounter=[], rng=None):
     if not(candidates):
         return []
 
+    r = rng or random
+
     encounter = deepcopy(origEncounter)
 # FIXME: what to do for xpthreshold 4??
     (lbound, ubound) = (xpThresholds[difficulty],xpThresholds[difficulty+1])
@@ -279,11 +314,11 @@ def generateOne(candidates, difficulty, xpThresholds, origEncounter=[]):
         return []
     
     while(not(ok)):
-        current = random.choice(candidates)
+        current = r.choice(candidates)
         currentXP = xpPerCR(hackFloat(current.get("challenge_rating", 0.0)))
         xp = encounterXP(encounter)
 
-        amount = random.choice(list(filter(lambda n: (encounterXP(encounter) + (n * currentXP)) * groupMultiplier(len(encounter) + n) <= ubound, range(21))))
+        amount = r.choice(list(filter(lambda n: (encounterXP(encounter) + (n * currentXP)) * groupMultiplier(len(encounter) + n) <= ubound, range(21))))
         encounter += [current for i in range(amount)]
         xp = encounterXP(encounter) * groupMultiplier(len(encounter))
         if xp <= ubound and xp >= lbound:
@@ -300,6 +335,20 @@ def generateOne(candidates, difficulty, xpThresholds, origEncounter=[]):
         
 
 
+def _generateJob(job):
+    (candidates, difficulty, xpThresholds, origEncounter, rng) = job
+    return generateOne(candidates, difficulty, xpThresholds, origEncounter, rng)
+
+
+def generateMany(candidates, difficulty, xpThresholds, n, rng, origEncounter=[], processes=1):
+    """Generates n encounters. Encounter i always uses the child stream rng.split(i), so the result is the same for any number of processes."""
+    jobs = [(candidates, difficulty, xpThresholds, origEncounter, rng.split(i)) for i in range(n)]
+    if processes <= 1:
+        return [_generateJob(job) for job in jobs]
+    with Pool(processes) as pool:
+        return pool.map(_generateJob, jobs)
+
+        
 def unroll(xs):
     acc = []
     for (x, n) in xs:
@@ -308,7 +357,7 @@ def unroll(xs):
     return acc
 
 
-def generator(ds):
+def generator(ds, rng=None):
     players = int(input("How many players: "))
     levels = [int(input("Level of player " + str(i) + ":")) for i in range(1, players + 1)]
     difficulty = int(input("How difficult?\n 1 - Easy\n 2 - Medium\n 3 - Hard\n 4 - Deadly\n"))
@@ -320,9 +369,12 @@ def generator(ds):
     inp = ""
     filt = [""]
     picks = []
+    # every many command gets its own child stream, so a seed gives the same batches for any number of cores
+    rng = rng or Stream()
+    batches = 0
     while(True):
         narrowCandidates = list(filter(lambda d: any(map(lambda w: w in d.get("name", "").lower(), filt)), candidates))
-        choice = generateOne(narrowCandidates, difficulty, xpThresholds, picks)
+        choice = generateOne(narrowCandidates, difficulty, xpThresholds, picks, rng)
         for (name, count) in countDuplicates([d.get("name", "") for d in choice]):
             print(str(count) + " " + name)
         print(str(encounterXP(choice)*groupMultiplier(len(choice)))) 
@@ -335,6 +387,14 @@ def generator(ds):
 
             # we wait for an enter
             input()
+        elif inp and (inp.split()[0] == "many"):
+            if (len(inp.split()) != 2) or not(inp.split()[1].isnumeric()):
+                print("Please specify the number of encounters, e.g. many 100.")
+                continue
+            encounters = generateMany(narrowCandidates, difficulty, xpThresholds, int(inp.split()[1]), rng.split(("many", batches)), picks, os.cpu_count() or 1)
+            batches += 1
+            for (i, e) in enumerate(encounters):
+                print(str(i + 1) + ". " + ", ".join([str(count) + " " + name for (name, count) in countDuplicates([d.get("name", "") for d in e])]) + " - " + str(encounterXP(e) * groupMultiplier(len(e))) + " XP")
         elif inp and inp[:4] == "pick":
             ws = inp[5:].split(",")
             try:
@@ -21,7 +21,7 @@ HELPTEXT = """monster.py - Python script to format monster information and geene
 Usage: monster.py [OPTION] COMMAND
 
 Commands
-  g, generate - Enter encounter generation mode, see below for syntax
+  g, generate [SEED] - Enter encounter generation mode, see below for syntax. With SEED the same answers generate the same encounters
   o, output - Output monster json database in emacs org-mode format
 
 Options
@@ -59,6 +59,9 @@ def mkActions(ds):
 
         if "damage_bonus" in d.keys():
             w += " +" + str(d["damage_bonus"])
+
+        if "damage_dice" in d.keys():
+            w += damageSummary(d)
         w += "\n"
         w += d["desc"]
         w += "\n"
@@ -202,7 +205,10 @@ def main(argv):
 
 
     if (argv[1] == "g") or (argv[1]== "generate"):
-        generator(ds)
+        if (len(argv) > 2) and argv[2].isnumeric():
+            generator(ds, Stream(int(argv[2])))
+        else:
+            generator(ds)
         return
 
 if (__name__ == "__main__"):